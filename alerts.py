@@ -0,0 +1,192 @@
+import argparse
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import db
+from schema import DB_PATH, create_tables, ensure_schema, get_meta, set_meta, uuid_keys
+
+ZSCORE_WINDOW = 28          # trailing days a day's streams are compared against
+MIN_HISTORY = 14            # days with data needed in that window before a z-score is trusted
+Z_THRESHOLD = 3.0           # spike: the day is this many standard deviations above its baseline
+MIN_DAILY_STREAMS = 1000    # spikes below this volume are noise
+BREAKOUT_PCT = 50.0         # breakout: the last 7 days are up this much on the 7 before
+MIN_WEEKLY_STREAMS = 5000   # breakouts below this 7-day volume are noise
+ARTIST_CHUNK = 500          # artists per matrix; bounds memory at chunk x series x days floats
+
+INSERT_SQL = """
+    INSERT INTO alerts (iso_date, region_id, metric_id, kind, artist_id, value, baseline, score)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def alerts_built(conn):
+    return get_meta(conn, "alerts_built_at") is not None
+
+def window_sums(values, window, lag=1):
+    """
+    Sums, sums of squares and non-NaN counts of the `window` days ending `lag` days before
+    each day (lag=1 leaves the day itself out, lag=0 includes it), for every row of a
+    (series x days) matrix at once, through cumulative sums.
+    """
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+    pad = np.zeros((values.shape[0], 1))
+    sums = np.hstack([pad, np.cumsum(filled, axis=1)])
+    squares = np.hstack([pad, np.cumsum(filled ** 2, axis=1)])
+    counts = np.hstack([pad, np.cumsum(present, axis=1)])
+    hi = np.maximum(np.arange(values.shape[1]) + 1 - lag, 0)
+    lo = np.maximum(hi - window, 0)
+    return sums[:, hi] - sums[:, lo], squares[:, hi] - squares[:, lo], counts[:, hi] - counts[:, lo]
+
+def zscores(values, window=ZSCORE_WINDOW, min_history=MIN_HISTORY):
+    """(z, baseline mean) of each day against its trailing window; NaN without enough history."""
+    sums, squares, counts = window_sums(values, window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = sums / counts
+        std = np.sqrt(np.maximum(squares / counts - mean ** 2, 0.0))
+        z = (values - mean) / std
+    z[(counts < min_history) | (std == 0)] = np.nan
+    return z, mean
+
+def week_over_week(values):
+    """(last 7 days, previous 7 days, % change) ending on each day; NaN unless both weeks are complete."""
+    sums, _, counts = window_sums(values, 7, lag=0)
+    week = np.where(counts == 7, sums, np.nan)
+    prev = np.full_like(week, np.nan)
+    prev[:, 7:] = week[:, :-7]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        change = (week - prev) / prev * 100
+    change[prev == 0] = np.nan
+    return week, prev, change
+
+def chunk_matrix(rows, first_day, n_days, id_dtype=np.int64):
+    """
+    (artist_id, region_id, metric_id, iso_date, count) rows ordered by the first four ->
+    (series keys, series x days matrix). Missing days are NaN. id_dtype is object for
+    UUID text ids.
+    """
+    table = np.array(rows, dtype=[
+        ("artist_id", id_dtype), ("region_id", id_dtype), ("metric_id", id_dtype),
+        ("iso_date", "datetime64[D]"), ("count", np.float64),
+    ])
+    artist_ids, region_ids, metric_ids = table["artist_id"], table["region_id"], table["metric_id"]
+    new_series = np.ones(len(table), dtype=bool)
+    new_series[1:] = ((artist_ids[1:] != artist_ids[:-1]) | (region_ids[1:] != region_ids[:-1])
+                      | (metric_ids[1:] != metric_ids[:-1]))
+    series = np.cumsum(new_series) - 1
+    days = table["iso_date"].astype(np.int64) - first_day
+    values = np.full((series[-1] + 1, n_days), np.nan)
+    values[series, days] = table["count"]
+    starts = np.flatnonzero(new_series)
+    keys = list(zip(artist_ids[starts].tolist(), region_ids[starts].tolist(), metric_ids[starts].tolist()))
+    return keys, values
+
+def detect(keys, values, first_day, report_from):
+    """Alert rows (iso_date, region_id, metric_id, kind, artist_id, value, baseline, score) from day report_from on."""
+    out = []
+    z, mean = zscores(values)
+    week, prev, change = week_over_week(values)
+    report = np.zeros(values.shape[1], dtype=bool)
+    report[report_from:] = True
+
+    with np.errstate(invalid="ignore"):
+        spikes = (z >= Z_THRESHOLD) & (values >= MIN_DAILY_STREAMS) & report
+        breakouts = (change >= BREAKOUT_PCT) & (week >= MIN_WEEKLY_STREAMS) & report
+    for kind, mask, value, baseline, score in (
+        ("spike", spikes, values, mean, z),
+        ("breakout", breakouts, week, prev, change),
+    ):
+        rows, cols = np.nonzero(mask)
+        for i, day, v, b, s in zip(rows, cols, value[rows, cols], baseline[rows, cols], score[rows, cols]):
+            artist_id, region_id, metric_id = keys[i]
+            iso_date = np.datetime64(int(first_day + day), "D").astype(str)
+            out.append((iso_date, region_id, metric_id, kind, artist_id, float(v), round(float(b), 1), round(float(s), 2)))
+    return out
+
+def build_alerts(conn, since=None, chunk=ARTIST_CHUNK):
+    """
+    Recompute alerts for every artist, region and metric from `since` (ISO date; default the
+    whole history) to the newest day, replacing what was stored for those days. Streams are
+    read one chunk of artists at a time, in primary-key order. Returns the alert count.
+    """
+    create_tables(conn)
+    lo, hi = conn.execute("SELECT MIN(iso_date), MAX(iso_date) FROM streams").fetchone()
+    if lo is None:
+        return 0
+    report_lo = max(since, lo) if since else lo
+    # Enough earlier days for the first reported day's z-score window and previous week
+    load_lo = max(lo, (date.fromisoformat(report_lo) - timedelta(days=max(ZSCORE_WINDOW, 14))).isoformat())
+    first_day = np.datetime64(load_lo, "D").astype(np.int64)
+    n_days = int(np.datetime64(hi, "D").astype(np.int64) - first_day) + 1
+    report_from = int(np.datetime64(report_lo, "D").astype(np.int64) - first_day)
+
+    artist_ids = [a for (a,) in conn.execute("SELECT DISTINCT artist_id FROM streams ORDER BY artist_id")]
+    id_dtype = object if uuid_keys(conn) else np.int64
+    total = 0
+    with conn:
+        conn.execute("DELETE FROM alerts WHERE iso_date >= ?", (report_lo,))
+        for i in range(0, len(artist_ids), chunk):
+            ids = artist_ids[i:i + chunk]
+            rows = conn.execute("""
+                SELECT artist_id, region_id, metric_id, iso_date, count FROM streams
+                WHERE artist_id BETWEEN ? AND ? AND iso_date BETWEEN ? AND ? AND count IS NOT NULL
+                ORDER BY artist_id, region_id, metric_id, iso_date
+            """, (ids[0], ids[-1], load_lo, hi)).fetchall()
+            if not rows:
+                continue
+            keys, values = chunk_matrix(rows, first_day, n_days, id_dtype)
+            found = detect(keys, values, first_day, report_from)
+            conn.executemany(INSERT_SQL, found)
+            total += len(found)
+        set_meta(conn, "alerts_built_at", datetime.now().isoformat(timespec="seconds"))
+    return total
+
+def load_alerts(conn, lo, hi, regions, metrics, limit=None):
+    """
+    Stored alerts dated lo..hi for the named regions and metrics, strongest first within
+    each kind. limit applies to each kind, so spikes cannot crowd out the breakouts.
+    """
+    region_placeholders = ",".join("?" * len(regions))
+    metric_placeholders = ",".join("?" * len(metrics))
+    sql = f"""
+        SELECT artist, region, metric, iso_date, kind, value, baseline, score
+        FROM (
+            SELECT a.name AS artist, r.name AS region, m.name AS metric, al.iso_date, al.kind,
+                   al.value, al.baseline, al.score,
+                   ROW_NUMBER() OVER (PARTITION BY al.kind ORDER BY al.score DESC) AS rank
+            FROM alerts al
+            JOIN regions r ON r.region_id = al.region_id
+            JOIN metrics m ON m.metric_id = al.metric_id
+            JOIN artists a ON a.artist_id = al.artist_id
+            WHERE al.iso_date BETWEEN ? AND ?
+              AND r.name IN ({region_placeholders}) AND m.name IN ({metric_placeholders})
+        )
+        WHERE ? IS NULL OR rank <= ?
+        ORDER BY kind DESC, score DESC
+    """
+    params = [lo, hi, *regions, *metrics, limit, limit]
+    return pd.DataFrame.from_records(
+        conn.execute(sql, params).fetchall(),
+        columns=["artist", "region", "metric", "iso_date", "kind", "value", "baseline", "score"],
+    )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find daily spikes and week-over-week breakouts for every artist.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    parser.add_argument("--since", help="Only recompute alerts from this date (YYYY-MM-DD); default the whole history")
+    parser.add_argument("--chunk", type=int, default=ARTIST_CHUNK, help="Artists per matrix")
+    args = parser.parse_args(argv)
+
+    conn = db.connect(args.db)
+    try:
+        ensure_schema(conn)
+        t0 = time.perf_counter()
+        n = build_alerts(conn, args.since, args.chunk)
+    finally:
+        conn.close()
+    print(f"Alerts rebuilt: {n} alerts in {time.perf_counter() - t0:.1f}s")
+
+if __name__ == "__main__":
+    main()
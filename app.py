@@ -1,12 +1,18 @@
 # app.py
 import streamlit as st
-import sqlite3
 import pandas as pd
 from datetime import timedelta, date
 import calendar
+import data_access
+import perf
+import snapshot
 from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, DataReturnMode, ColumnsAutoSizeMode, JsCode
 
 DB_PATH = "datamoney_demo.db"
+FLAGS = {"US": "🇺🇸", "Global": "🌎"}  # header prefix; other regions are shown by name
+
+perf.reset()
+profiler = perf.start_profile()
 
 # --- Page & sidebar ---
 st.set_page_config(layout="wide")
@@ -27,19 +33,17 @@ st.markdown("""
 
 # --- Load dates from DB ---
 try:
-    with sqlite3.connect(DB_PATH) as conn:
-        df_dates = pd.read_sql("SELECT DISTINCT date FROM streams", conn)
-    df_dates['date_dt'] = pd.to_datetime(df_dates['date'], format="%m/%d/%Y")
-    date_min = df_dates['date_dt'].min().date()
-    date_max = df_dates['date_dt'].max().date()
-
-    df_dates['year'] = df_dates['date_dt'].dt.year
-    df_dates['month_year'] = df_dates['date_dt'].dt.strftime('%B %Y')
-    all_years = sorted(df_dates['year'].unique(), reverse=True)
-    all_months = sorted(df_dates['month_year'].unique(), reverse=True)
+    with perf.stage("dates.load"):
+        date_index = data_access.load_date_index(DB_PATH)
+    date_min = date_index["date_min"]
+    date_max = date_index["date_max"]
+    all_years = date_index["years"]
+    all_months = date_index["months"]
+    dimensions = data_access.load_dimensions(DB_PATH)
 
 except Exception as e:
     st.error(f"Error loading dates from database: {e}")
+    perf.dump_profile(profiler, "app")  # st.stop() skips the one at the end
     st.stop()
 
 # --- Sidebar controls ---
@@ -121,76 +125,75 @@ elif mode == "Yearly Streams":
     )
     selected_lookback_date = date(lookback_year, 1, 1)
 
+# --- Regions and metrics compared ---
+# Any number of them is compared by the same single grouped query
+selected_regions = st.sidebar.multiselect(
+    "Regions",
+    options=dimensions["regions"],
+    default=[r for r in snapshot.REGIONS if r in dimensions["regions"]]
+)
+selected_metrics = st.sidebar.multiselect(
+    "Streaming Metrics",
+    options=dimensions["metrics"],
+    default=[m for m in snapshot.METRICS if m in dimensions["metrics"]]
+)
+if not selected_regions or not selected_metrics:
+    st.warning("Select at least one region and one metric.")
+    perf.dump_profile(profiler, "app")  # st.stop() skips the one at the end
+    st.stop()
+
+# (region, metric, column prefix) for every comparison shown
+comparisons = [
+    (region, metric, snapshot.comparison_label(region, metric, selected_metrics))
+    for region in selected_regions for metric in selected_metrics
+]
+
+# --- Rows sent to the grid ---
+# Sorting, the volume threshold and paging run server-side so the browser only ever
+# receives one page, however large the artist catalog is.
+row_view = st.sidebar.selectbox("Rows", ("All Artists", "Top Movers", "Bottom Movers"))
+# Rank column -> the previous-period column the volume threshold applies to
+column_sets = [snapshot.comparison_columns(label) for *_, label in comparisons]
+rank_columns = {pct_col: prev_col for _, prev_col, pct_col in column_sets}
+rank_columns.update({now_col: prev_col for now_col, prev_col, _ in column_sets})
+sort_by = st.sidebar.selectbox("Rank By", list(rank_columns))
+min_volume = st.sidebar.number_input("Minimum Previous Streams", min_value=0, value=0, step=1000)
+search = st.sidebar.text_input("Search Artist")
+if row_view == "All Artists":
+    page_size = st.sidebar.selectbox("Page Size", (250, 500, 1000, 5000), index=2)
+    page = st.sidebar.number_input("Page", min_value=1, value=1, step=1)
+else:
+    page_size = st.sidebar.number_input("Number of Artists", min_value=1, max_value=5000, value=100, step=50)
+    page = 1
+
 # --- Fetch snapshot ---
 def fetch_snapshot(cur_date, prev_date, mode):
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            if mode == "Daily Streams":
-                cur_range = (cur_date, cur_date)
-                prev_range = (prev_date, prev_date)
-            elif mode == "Weekly Streams":
-                cur_range = (cur_date - timedelta(days=6), cur_date)
-                prev_range = (prev_date - timedelta(days=6), prev_date)
-            elif mode == "Monthly Streams":
-                cur_range_start = cur_date.replace(day=1)
-                cur_range_end = cur_date.replace(day=calendar.monthrange(cur_date.year, cur_date.month)[1])
-                prev_range_start = prev_date.replace(day=1)
-                prev_range_end = prev_date.replace(day=calendar.monthrange(prev_date.year, prev_date.month)[1])
-                cur_range = (cur_range_start, cur_range_end)
-                prev_range = (prev_range_start, prev_range_end)
-            elif mode == "Yearly Streams":
-                cur_range = (cur_date.replace(month=1, day=1), cur_date.replace(month=12, day=31))
-                prev_range = (prev_date.replace(month=1, day=1), prev_date.replace(month=12, day=31))
-
-            sql_template = """
-            SELECT a.name as artist, SUM(s.count) as total_streams
-            FROM streams s
-            JOIN artists a ON s.artist_id = a.artist_id
-            JOIN regions r ON s.region_id = r.region_id
-            WHERE r.name = ? AND s.date BETWEEN ? AND ?
-            GROUP BY a.name
-            """
-
-            us_cur_results = conn.execute(sql_template, ('US', cur_range[0].strftime("%m/%d/%Y"), cur_range[1].strftime("%m/%d/%Y"))).fetchall()
-            us_prev_results = conn.execute(sql_template, ('US', prev_range[0].strftime("%m/%d/%Y"), prev_range[1].strftime("%m/%d/%Y"))).fetchall()
-            gl_cur_results = conn.execute(sql_template, ('Global', cur_range[0].strftime("%m/%d/%Y"), cur_range[1].strftime("%m/%d/%Y"))).fetchall()
-            gl_prev_results = conn.execute(sql_template, ('Global', prev_range[0].strftime("%m/%d/%Y"), prev_range[1].strftime("%m/%d/%Y"))).fetchall()
-            
-            us_cur = dict(us_cur_results)
-            us_prev = dict(us_prev_results)
-            gl_cur = dict(gl_cur_results)
-            gl_prev = dict(gl_prev_results)
-
+        with perf.stage("snapshot.fetch", mode=mode) as record:
+            df = data_access.fetch_snapshot(DB_PATH, mode, cur_date, prev_date, selected_regions, selected_metrics)
+            record["rows"] = len(df)
+        return df
     except Exception as e:
         st.error(f"Error fetching data from database: {e}")
         return pd.DataFrame()
 
-    artists = set(us_cur) | set(us_prev) | set(gl_cur) | set(gl_prev)
-    rows = []
-    for artist in sorted(artists):
-        us_now = us_cur.get(artist)
-        us_then = us_prev.get(artist)
-        gl_now = gl_cur.get(artist)
-        gl_then = gl_prev.get(artist)
-
-        def pct_change(now, then):
-            if now is None or then is None or then == 0:
-                return None
-            return round(((now - then) / then) * 100, 2)
-
-        rows.append({
-            "Artist": artist,
-            "US Streams": us_now,
-            "US Streams Prev": us_then,
-            "% Change US": pct_change(us_now, us_then),
-            "Global Streams": gl_now,
-            "Global Streams Prev": gl_then,
-            "% Change Global": pct_change(gl_now, gl_then),
-        })
-    return pd.DataFrame(rows)
-
 # --- Display grid ---
 df = fetch_snapshot(selected_date, selected_lookback_date, mode)
+total_artists = 0
+if not df.empty:
+    volume_col = rank_columns[sort_by]
+    with perf.stage("rows.select") as record:
+        df, total_artists = snapshot.select_rows(
+            df,
+            sort_by,
+            descending=row_view != "Bottom Movers",
+            limit=page_size,
+            offset=(page - 1) * page_size,
+            min_volume=min_volume,
+            volume_col=volume_col,
+            search=search,
+        )
+        record["rows"] = len(df)
 
 # --- Sidebar display ---
 if mode == "Daily Streams":
@@ -221,6 +224,42 @@ elif mode == "Yearly Streams":
         f"Comparing {selected_date.strftime('%Y')} vs "
         f"{selected_lookback_date.strftime('%Y')}"
     )
+first_row = (page - 1) * page_size
+st.sidebar.caption(f"Showing {min(first_row + 1, total_artists)}-{first_row + len(df)} of {total_artists} artists")
+
+# --- Alerts for the current period ---
+# Spikes and breakouts are precomputed for every artist by alerts.py; this only reads them.
+cur_range, _ = snapshot.period_ranges(mode, selected_date, selected_lookback_date)
+try:
+    with perf.stage("alerts.fetch") as record:
+        alerts_df = data_access.fetch_alerts(
+            DB_PATH, cur_range[0].isoformat(), cur_range[1].isoformat(), selected_regions, selected_metrics
+        )
+        record["rows"] = 0 if alerts_df is None else len(alerts_df)
+except Exception as e:
+    st.error(f"Error fetching alerts: {e}")
+    alerts_df = None
+
+if alerts_df is not None:
+    with st.expander(f"Alerts ({len(alerts_df)})", expanded=False):
+        if alerts_df.empty:
+            st.caption("No spikes or breakouts in this period.")
+        else:
+            st.caption("Spike: streams that day vs. the trailing 28-day mean (score in standard deviations). "
+                       "Breakout: the last 7 days vs. the 7 before (score in %).")
+            alerts_view = pd.DataFrame({
+                "Artist": alerts_df["artist"],
+                "Region": alerts_df["region"].map(lambda r: f"{FLAGS.get(r, '')} {r}".strip()),
+                "Metric": alerts_df["metric"],
+                "Date": pd.to_datetime(alerts_df["iso_date"]).dt.strftime("%m/%d/%Y"),
+                "Alert": alerts_df["kind"].str.capitalize(),
+                "Streams": alerts_df["value"].round(0),
+                "Baseline": alerts_df["baseline"].round(0),
+                "Score": alerts_df["score"],
+            })
+            if len(selected_metrics) == 1:
+                alerts_view = alerts_view.drop(columns=["Metric"])
+            st.dataframe(alerts_view, hide_index=True)
 
 # --- Ag-Grid configuration ---
 gb = GridOptionsBuilder.from_dataframe(df)
@@ -250,24 +289,61 @@ function(params) {
 """)
 
 gb.configure_column("Artist", filter="agTextColumnFilter", sortable=True)
-gb.configure_column("US Streams", header_name="🇺🇸 Current Streams", type=['numericColumn', 'numberColumnFilter'], precision=0, agg_func='sum', valueFormatter=number_formatter)
-gb.configure_column("US Streams Prev", header_name="🇺🇸 Previous Streams", type=['numericColumn', 'numberColumnFilter'], precision=0, agg_func='sum', valueFormatter=number_formatter)
-gb.configure_column("% Change US", header_name="🇺🇸 % Change", type=['numericColumn', 'numberColumnFilter'], valueFormatter=pct_formatter, cellStyle=pct_style, sort="desc")
-gb.configure_column("Global Streams", header_name="🌎 Current Streams", type=['numericColumn', 'numberColumnFilter'], precision=0, agg_func='sum', valueFormatter=number_formatter)
-gb.configure_column("Global Streams Prev", header_name="🌎 Previous Streams", type=['numericColumn', 'numberColumnFilter'], precision=0, agg_func='sum', valueFormatter=number_formatter)
-gb.configure_column("% Change Global", header_name="🌎 % Change", type=['numericColumn', 'numberColumnFilter'], valueFormatter=pct_formatter, cellStyle=pct_style)
-
+for region, metric, label in comparisons:
+    prefix = FLAGS.get(region, region)
+    if len(selected_metrics) > 1:
+        prefix = f"{prefix} {metric}"
+    now_col, prev_col, pct_col = snapshot.comparison_columns(label)
+    gb.configure_column(now_col, header_name=f"{prefix} Current Streams", type=['numericColumn', 'numberColumnFilter'], precision=0, agg_func='sum', valueFormatter=number_formatter)
+    gb.configure_column(prev_col, header_name=f"{prefix} Previous Streams", type=['numericColumn', 'numberColumnFilter'], precision=0, agg_func='sum', valueFormatter=number_formatter)
+    gb.configure_column(pct_col, header_name=f"{prefix} % Change", type=['numericColumn', 'numberColumnFilter'], valueFormatter=pct_formatter, cellStyle=pct_style)
+
+gb.configure_column(sort_by, sort="asc" if row_view == "Bottom Movers" else "desc")
+gb.configure_selection(selection_mode="single")
 gb.configure_grid_options(domLayout='normal')
 gridOptions = gb.build()
 
-AgGrid(
-    df,
-    gridOptions=gridOptions,
-    enable_enterprise_modules=True,
-    allow_unsafe_jscode=True,
-    update_mode=GridUpdateMode.MODEL_CHANGED,
-    data_return_mode=DataReturnMode.FILTERED_AND_SORTED,
-    columns_auto_size_mode=ColumnsAutoSizeMode.FIT_ALL_COLUMNS_TO_VIEW,
-    height=700,
-    key="aggrid_key"
-)
+# Serializing the page and mounting the component
+with perf.stage("grid.render", rows=len(df)):
+    grid = AgGrid(
+        df,
+        gridOptions=gridOptions,
+        enable_enterprise_modules=True,
+        allow_unsafe_jscode=True,
+        update_mode=GridUpdateMode.MODEL_CHANGED,
+        data_return_mode=DataReturnMode.FILTERED_AND_SORTED,
+        columns_auto_size_mode=ColumnsAutoSizeMode.FIT_ALL_COLUMNS_TO_VIEW,
+        height=700,
+        key="aggrid_key"
+    )
+
+
+# --- Artist drill-down ---
+# Clicking a row charts that artist's daily history; the series comes from the
+# per-artist index and is cached per artist.
+selected = grid.selected_rows
+if isinstance(selected, pd.DataFrame):
+    selected = selected.to_dict("records")
+if selected:
+    artist = selected[0]["Artist"]
+    try:
+        with perf.stage("series.fetch", artist=artist) as record:
+            series = data_access.fetch_artist_series(DB_PATH, artist, selected_regions, selected_metrics)
+            record["rows"] = len(series)
+    except Exception as e:
+        st.error(f"Error fetching history for {artist}: {e}")
+        series = pd.DataFrame()
+
+    if not series.empty:
+        st.subheader(artist)
+        for region in selected_regions:
+            st.caption(f"{FLAGS.get(region, region)} Daily Streams")
+            st.line_chart(series[[f"{region} Streams", *(f"{region} {w}-Day Avg" for w in snapshot.ROLLING_WINDOWS)]])
+
+# Step ahead: the periods either side of this one are computed in the background
+data_access.prefetch_adjacent(DB_PATH, mode, selected_date, selected_lookback_date, date_min, date_max,
+                              selected_regions, selected_metrics)
+
+# --- Performance breakdown of this rerun ---
+data_access.render_perf_panel()
+perf.dump_profile(profiler, "app")
@@ -1,8 +1,10 @@
 # app.py
 import streamlit as st
-import sqlite3
 import pandas as pd
 from datetime import timedelta
+import data_access
+import perf
+import snapshot
 from streamlit_slickgrid import slickgrid, FieldType, Formatters
 
 # NOTE: The database path must be correct for the app to run.
@@ -10,19 +12,22 @@ from streamlit_slickgrid import slickgrid, FieldType, Formatters
 # Using a placeholder for demonstration.
 DB_PATH = "datamoney.db" 
 
+perf.reset()
+profiler = perf.start_profile()
+
 # --- Page & sidebar ---
 st.set_page_config(layout="wide")
 st.sidebar.header("Controls")
 
 # --- Load dates from DB ---
 try:
-    with sqlite3.connect(DB_PATH) as conn:
-        df_dates = pd.read_sql("SELECT DISTINCT date FROM streams", conn)
-    df_dates['date_dt'] = pd.to_datetime(df_dates['date'], format="%m/%d/%Y")
-    date_min = df_dates['date_dt'].min().date()
-    date_max = df_dates['date_dt'].max().date()
+    with perf.stage("dates.load"):
+        date_index = data_access.load_date_index(DB_PATH)
+    date_min = date_index["date_min"]
+    date_max = date_index["date_max"]
 except Exception as e:
     st.error(f"Error loading dates from database: {e}")
+    perf.dump_profile(profiler, "app_slickgrid")  # st.stop() skips the one at the end
     st.stop()
 
 # --- Sidebar controls ---
@@ -42,64 +47,38 @@ st.sidebar.write(
     f"{lookback_date.strftime('%m/%d/%Y')}"
 )
 
+# Only the requested movers are serialized to the grid; ranking runs server-side
+row_view = st.sidebar.selectbox("Rows", ("Top Movers", "Bottom Movers"))
+top_n = st.sidebar.number_input("Number of Artists", min_value=1, max_value=5000, value=500, step=50)
+min_volume = st.sidebar.number_input("Minimum Previous US Streams", min_value=0, value=0, step=1000)
+
 # --- Fetch snapshot ---
-def fetch_snapshot(cur_date_str, prev_date_str):
+def fetch_snapshot(cur_date, prev_date):
     """
     Fetches and processes stream data for a given date and a lookback date.
     """
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            us_sql = """
-            SELECT a.name as artist, s.count
-            FROM streams s
-            JOIN artists a ON s.artist_id = a.artist_id
-            JOIN regions r ON s.region_id = r.region_id
-            WHERE r.name = 'US' AND s.date = ?
-            """
-            us_cur_results = conn.execute(us_sql, (cur_date_str,)).fetchall()
-            us_prev_results = conn.execute(us_sql, (prev_date_str,)).fetchall()
-            
-            us_cur = dict(us_cur_results)
-            us_prev = dict(us_prev_results)
-
-            gl_sql = us_sql.replace("'US'", "'Global'") # Correctly replace to get global data
-            gl_cur_results = conn.execute(gl_sql, (cur_date_str,)).fetchall()
-            gl_prev_results = conn.execute(gl_sql, (prev_date_str,)).fetchall()
-            
-            gl_cur = dict(gl_cur_results)
-            gl_prev = dict(gl_prev_results)
-
+        with perf.stage("snapshot.fetch", mode="Daily Streams") as record:
+            df = data_access.fetch_snapshot(DB_PATH, "Daily Streams", cur_date, prev_date)
+            record["rows"] = len(df)
     except Exception as e:
         st.error(f"Error fetching data from database: {e}")
         return pd.DataFrame()
 
-    artists = set(us_cur) | set(us_prev) | set(gl_cur) | set(gl_prev)
-    rows = []
-    for i, artist in enumerate(sorted(artists), start=1):
-        us_now = us_cur.get(artist)
-        us_then = us_prev.get(artist)
-        gl_now = gl_cur.get(artist)
-        gl_then = gl_prev.get(artist)
-
-        def pct_change(now, then):
-            if now is None or then is None or then == 0:
-                return None
-            return round(((now - then) / then) * 100, 2)
-
-        rows.append({
-            "id": i,
-            "Artist": artist,
-            "US Streams": us_now,
-            "US Streams Prev": us_then,
-            "% Change US": pct_change(us_now, us_then),
-            "Global Streams": gl_now,
-            "% Change Global": pct_change(gl_now, gl_then),
-        })
-    return pd.DataFrame(rows)
-
-cur_date_str = selected_date.strftime("%m/%d/%Y")
-prev_date_str = lookback_date.strftime("%m/%d/%Y")
-df = fetch_snapshot(cur_date_str, prev_date_str).fillna("")
+    with perf.stage("rows.select") as record:
+        df, _ = snapshot.select_rows(
+            df,
+            "% Change US",
+            descending=row_view == "Top Movers",
+            limit=top_n,
+            min_volume=min_volume,
+            volume_col="US Streams Prev",
+        )
+        record["rows"] = len(df)
+    df.insert(0, "id", range(1, len(df) + 1))
+    return df.drop(columns=["Global Streams Prev"])
+
+df = fetch_snapshot(selected_date, lookback_date).fillna("")
 
 # --- SlickGrid columns ---
 columns = [
@@ -129,9 +108,17 @@ st.write(f"### Data Money {selected_date.strftime('%m/%d/%Y')} (vs {lookback_day
 
 # The key fix: tie the grid's key to the selected date. This forces a re-render
 # whenever the date changes, preventing the "one step behind" issue.
-out = slickgrid(df.to_dict("records"), columns, options, key=f"streams_grid_{selected_date}")
+with perf.stage("grid.render", rows=len(df)):
+    out = slickgrid(df.to_dict("records"), columns, options, key=f"streams_grid_{selected_date}")
 
 # --- You can remove the old state management logic as it's no longer needed ---
 # if out is not None:
 #     _, _, new_grid_state = out
 #     st.session_state.grid_state = new_grid_state
+
+# Step ahead: the days either side of this one are computed in the background
+data_access.prefetch_adjacent(DB_PATH, "Daily Streams", selected_date, lookback_date, date_min, date_max)
+
+# --- Performance breakdown of this rerun ---
+data_access.render_perf_panel()
+perf.dump_profile(profiler, "app_slickgrid")
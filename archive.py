@@ -0,0 +1,378 @@
+import argparse
+import os
+import time
+from datetime import date, timedelta
+
+import pandas as pd
+
+import db
+from schema import DB_PATH, ensure_schema, get_meta, has_table, set_meta, uuid_keys
+
+# pyarrow and parquet_store are imported inside the functions that read or write year
+# files, so the many modules importing this one only load them once something is archived
+
+ARCHIVE_HORIZON_DAYS = 730   # days kept in SQLite; this year and last are never archived
+COMPRESSION = "zstd"
+COMPRESSION_LEVEL = 9        # archive files are written once and read rarely
+ROW_GROUP_ROWS = 128 * 1024  # rows are sorted by region, metric, date: row groups outside a range are skipped
+
+KEYS = ["artist_id", "region_id", "metric_id", "iso_date"]
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()  # date32 values are days since 1970-01-01
+
+# meta keys: first day still in streams, where the year files are, first archived day
+BOUNDARY_KEY, DIR_KEY, FIRST_KEY = "archived_before", "archive_dir", "archive_first_date"
+
+def archived_before(conn):
+    """First day still held in streams (a January 1st), or None when nothing has been archived."""
+    return get_meta(conn, BOUNDARY_KEY)
+
+def db_file(conn):
+    return next(path for _, name, path in conn.execute("PRAGMA database_list") if name == "main")
+
+def default_dir(db_path):
+    return os.path.splitext(db_path)[0] + "_archive"
+
+def archive_dir(conn):
+    """The archive directory; stored relative to the database file when it sits next to it."""
+    root = get_meta(conn, DIR_KEY)
+    return os.path.join(os.path.dirname(db_file(conn)), root) if root else None
+
+def year_path(root, year):
+    return os.path.join(root, f"year={year}", "part-0.parquet")
+
+def archived_range(conn, lo=None, hi=None):
+    """lo..hi (ISO dates, default unbounded) clamped to the archived days, or None if they miss them."""
+    boundary = archived_before(conn)
+    if not boundary:
+        return None
+    lo = max(lo or "", get_meta(conn, FIRST_KEY))
+    hi = min(hi or boundary, (date.fromisoformat(boundary) - timedelta(days=1)).isoformat())
+    return (lo, hi) if lo <= hi else None
+
+def archived_months(conn):
+    """'YYYY-MM' of every month before the boundary, from the first archived day."""
+    span = archived_range(conn)
+    if span is None:
+        return []
+    from parquet_store import month_partitions
+    return [f"{year}-{month:02d}" for year, month in month_partitions(*span)]
+
+def split_periods(periods, boundary):
+    """
+    (hot, archived) parts of (period, lo, hi) ISO date ranges: days from the boundary on
+    are read from streams, days before it from the archive. Either list may be empty.
+    """
+    if not boundary:
+        return list(periods), []
+    last_archived = (date.fromisoformat(boundary) - timedelta(days=1)).isoformat()
+    hot = [(period, max(lo, boundary), hi) for period, lo, hi in periods if hi >= boundary]
+    cold = [(period, lo, min(hi, last_archived)) for period, lo, hi in periods if lo < boundary]
+    return hot, cold
+
+def late_rows(conn, lo, hi, region_ids=None, metric_ids=None, artist_id=None):
+    """
+    Rows still in streams for archived days lo..hi: ingested after their year was archived
+    and merged into its file on the next archive run. On the same key they win over the
+    archived row, as merge_year does. Returns a frame of KEYS and count.
+    """
+    clauses, params = ["iso_date BETWEEN ? AND ?"], [lo, hi]
+    for column, ids in (("region_id", region_ids), ("metric_id", metric_ids)):
+        if ids is not None:
+            ids = list(ids)
+            clauses.append(f"{column} IN ({','.join('?' * len(ids))})")
+            params += ids
+    if artist_id is not None:
+        clauses.append("artist_id = ?")
+        params.append(artist_id)
+    return pd.DataFrame(conn.execute(f"""
+        SELECT artist_id, region_id, metric_id, iso_date, count FROM streams
+        WHERE {' AND '.join(clauses)}
+    """, params).fetchall(), columns=[*KEYS, "count"])
+
+def date_filter(lo, hi):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    return ((ds.field("year") >= int(lo[:4])) & (ds.field("year") <= int(hi[:4]))
+            & (ds.field("iso_date") >= pa.scalar(date.fromisoformat(lo), pa.date32()))
+            & (ds.field("iso_date") <= pa.scalar(date.fromisoformat(hi), pa.date32())))
+
+def archived_rows(dataset, lo, hi, region_ids, metric_ids, artist_ids):
+    """Archived rows (KEYS and count) of some artists for lo..hi, with ISO date strings."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    table = dataset.to_table(columns=[*KEYS, "count"], filter=(
+        date_filter(lo, hi)
+        & ds.field("artist_id").isin(pa.array(list(artist_ids), pa.int64()))
+        & ds.field("region_id").isin(pa.array(list(region_ids), pa.int64()))
+        & ds.field("metric_id").isin(pa.array(list(metric_ids), pa.int64()))
+    ))
+    return pd.DataFrame({
+        "artist_id": pc.cast(table["artist_id"], pa.int64()).to_numpy(),
+        "region_id": pc.cast(table["region_id"], pa.int64()).to_numpy(),
+        "metric_id": pc.cast(table["metric_id"], pa.int64()).to_numpy(),
+        "iso_date": pc.cast(table["iso_date"], pa.string()).to_pylist(),
+        "count": table["count"].to_numpy(zero_copy_only=False),
+    })
+
+def with_late(totals, late, dataset):
+    """
+    count_sum per (artist_id, region_id, metric_id) with late rows counted in place of
+    the archived rows they replace.
+    """
+    ids = ["artist_id", "region_id", "metric_id"]
+    replaced = archived_rows(dataset, late["iso_date"].min(), late["iso_date"].max(), late["region_id"].unique(),
+                             late["metric_id"].unique(), late["artist_id"].unique()).merge(late[KEYS], on=KEYS)
+    change = pd.concat([late[[*ids, "count"]], replaced[ids].assign(count=-replaced["count"])])
+    return (pd.concat([totals[[*ids, "count_sum"]], change.rename(columns={"count": "count_sum"})])
+            .groupby(ids, as_index=False)["count_sum"].sum(min_count=1))
+
+def fetch_totals(conn, periods, regions, metrics):
+    """
+    (artist, region, metric, period, total) rows from the archive for each archived
+    (period, lo, hi), the same long rows the snapshot query returns. Late rows still in
+    streams for those days are counted instead of the archived rows they replace.
+    """
+    if not periods:
+        return []
+    from parquet_store import name_map, open_dataset, range_totals
+    region_map = name_map(conn, "regions", regions)
+    metric_map = name_map(conn, "metrics", metrics)
+    if not region_map or not metric_map:
+        return []
+    dataset = open_dataset(archive_dir(conn))
+    artist_map = name_map(conn, "artists")
+
+    rows = []
+    for period, lo, hi in periods:
+        totals = range_totals(dataset, lo, hi, list(region_map), list(metric_map))
+        late = late_rows(conn, lo, hi, region_map, metric_map)
+        if len(late):
+            totals = with_late(totals, late, dataset)
+        rows += zip(
+            totals["artist_id"].map(artist_map),
+            totals["region_id"].map(region_map),
+            totals["metric_id"].map(metric_map),
+            [period] * len(totals),
+            totals["count_sum"].tolist(),
+        )
+    return rows
+
+def artist_days(conn, artist, regions, metrics, lo=None, hi=None):
+    """
+    (region, iso_date, total) archived rows of one artist, summed over metrics, for lo..hi;
+    late rows still in streams for those days win over archived rows on the same key.
+    """
+    span = archived_range(conn, lo, hi)
+    if span is None:
+        return []
+    from parquet_store import name_map, open_dataset
+    region_map = name_map(conn, "regions", regions)
+    metric_map = name_map(conn, "metrics", metrics)
+    artist_id = conn.execute("SELECT artist_id FROM artists WHERE name = ?", (artist,)).fetchone()
+    if not region_map or not metric_map or artist_id is None:
+        return []
+    lo, hi = span
+    frame = pd.concat([
+        archived_rows(open_dataset(archive_dir(conn)), lo, hi, region_map, metric_map, artist_id),
+        late_rows(conn, lo, hi, region_map, metric_map, artist_id[0]),
+    ], ignore_index=True).drop_duplicates(KEYS, keep="last")
+    totals = frame.groupby(["region_id", "iso_date"], as_index=False)["count"].sum(min_count=1)  # NULL if all NULL, as SUM()
+    return list(zip(totals["region_id"].map(region_map), totals["iso_date"], totals["count"].tolist()))
+
+def coverage_runs(conn, region_ids=None, lo=None, hi=None):
+    """
+    (artist_id, region_id, first, last) day-ordinal runs of consecutive archived days (or
+    late rows still in streams for them) for every artist/region pair, optionally limited
+    to some regions and to lo..hi.
+    """
+    span = archived_range(conn, lo, hi)
+    if span is None:
+        return []
+    lo, hi = span
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    from parquet_store import open_dataset
+    row_filter = date_filter(lo, hi)
+    if region_ids is not None:
+        row_filter = row_filter & ds.field("region_id").isin(pa.array(list(region_ids), pa.int64()))
+    table = open_dataset(archive_dir(conn)).to_table(columns=["artist_id", "region_id", "iso_date"], filter=row_filter)
+    late = late_rows(conn, lo, hi, region_ids)
+
+    days = pd.concat([pd.DataFrame({
+        "artist_id": pc.cast(table["artist_id"], pa.int64()).to_numpy(),
+        "region_id": pc.cast(table["region_id"], pa.int64()).to_numpy(),
+        "day": pc.cast(table["iso_date"], pa.int32()).to_numpy() + EPOCH_ORDINAL,
+    }), pd.DataFrame({
+        "artist_id": late["artist_id"],
+        "region_id": late["region_id"],
+        "day": pd.Series([date.fromisoformat(d).toordinal() for d in late["iso_date"]], dtype="int64"),
+    })]).drop_duplicates().sort_values(["artist_id", "region_id", "day"])
+    # A run starts wherever the pair changes or the previous day is not the day before
+    previous = days.shift()
+    starts = ((days["artist_id"] != previous["artist_id"]) | (days["region_id"] != previous["region_id"])
+              | (days["day"] != previous["day"] + 1))
+    runs = days.groupby(starts.cumsum().to_numpy()).agg(
+        artist_id=("artist_id", "first"), region_id=("region_id", "first"), first=("day", "min"), last=("day", "max"))
+    return list(runs.itertuples(index=False, name=None))
+
+def write_year(table, path):
+    """
+    Write a year's table to path through a temporary file that is read back and synced
+    before it replaces the old one, so a year file is always complete. Returns bytes written.
+    """
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    pq.write_table(table, tmp, compression=COMPRESSION, compression_level=COMPRESSION_LEVEL,
+                   row_group_size=ROW_GROUP_ROWS)
+    written = pq.read_table(tmp, columns=["count"])
+    if written.num_rows != table.num_rows or pc.sum(written["count"]) != pc.sum(table["count"]):
+        os.remove(tmp)
+        raise SystemExit(f"{tmp} does not read back the rows written to it")
+    with open(tmp, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return os.path.getsize(path)
+
+def merge_year(old, new):
+    """An archived year with rows ingested later for it; on the same key the later row wins."""
+    from parquet_store import streams_table
+    frame = pd.concat([old.to_pandas(), new.to_pandas()], ignore_index=True)
+    frame = frame.drop_duplicates(KEYS, keep="last").sort_values(["region_id", "metric_id", "iso_date", "artist_id"])
+    return streams_table(list(zip(
+        frame["artist_id"].astype("int64").tolist(), frame["region_id"].astype("int64").tolist(),
+        frame["metric_id"].astype("int64").tolist(), [d.isoformat() for d in frame["iso_date"]],
+        [None if pd.isna(count) else int(count) for count in frame["count"]],  # NULL counts come back as NaN
+    )))
+
+def archive_streams(conn, root, horizon_days=ARCHIVE_HORIZON_DAYS):
+    """
+    Move every calendar year that ended more than horizon_days before the newest day out
+    of streams into one zstd Parquet file per year under root/year=YYYY/. Rows written
+    since for already archived years are merged into their file. Stream rows are only
+    deleted after every file has been written and read back, and only if streams did not
+    change meanwhile. Rollups of archived periods are dropped; coverage is kept.
+    Returns {year: (rows, bytes)}.
+    """
+    import pyarrow.parquet as pq
+    from parquet_store import streams_table
+    if uuid_keys(conn):
+        raise SystemExit("Archiving needs integer keys: run migrate_keys.py first")
+    lo, hi = conn.execute("SELECT MIN(iso_date), MAX(iso_date) FROM streams").fetchone()
+    if lo is None:
+        return {}
+    cutoff = date.fromisoformat(hi) - timedelta(days=horizon_days)
+    boundary = max(f"{cutoff.year}-01-01", archived_before(conn) or "")
+    if lo >= boundary:
+        return {}
+
+    written = {}
+    moved = [0, 0]  # rows and SUM(count) taken from streams, checked again before deleting
+    for year in range(int(lo[:4]), int(boundary[:4])):
+        t0 = time.perf_counter()
+        rows = conn.execute("""
+            SELECT artist_id, region_id, metric_id, iso_date, count FROM streams
+            WHERE iso_date BETWEEN ? AND ?
+            ORDER BY region_id, metric_id, iso_date, artist_id
+        """, (f"{year}-01-01", f"{year}-12-31")).fetchall()
+        if not rows:
+            continue
+        moved[0] += len(rows)
+        moved[1] += sum(row[4] or 0 for row in rows)
+        table = streams_table(rows)
+        path = year_path(root, year)
+        if os.path.exists(path):
+            table = merge_year(pq.read_table(path), table)
+        written[year] = (len(rows), write_year(table, path))
+        print(f"  {year}: {len(rows)} rows -> {written[year][1] / (1024 * 1024):.1f} MB in {time.perf_counter() - t0:.1f}s")
+
+    first = min(lo, get_meta(conn, FIRST_KEY) or lo)
+    relative = os.path.relpath(os.path.abspath(root), os.path.dirname(os.path.abspath(db_file(conn))))
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        now = conn.execute("SELECT COUNT(*), COALESCE(SUM(count), 0) FROM streams WHERE iso_date < ?", (boundary,)).fetchone()
+        if list(now) != moved:
+            raise SystemExit("Streams changed while archiving; nothing was deleted, run again")
+        conn.execute("DELETE FROM streams WHERE iso_date < ?", (boundary,))
+        if has_table(conn, "stream_rollups"):
+            conn.execute("DELETE FROM stream_rollups WHERE period < ?", (boundary[:4],))
+        set_meta(conn, BOUNDARY_KEY, boundary)
+        set_meta(conn, FIRST_KEY, first)
+        set_meta(conn, DIR_KEY, relative if not relative.startswith("..") else os.path.abspath(root))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return written
+
+def restore_year(conn):
+    """
+    Move the newest archived year back into streams (rows ingested since for it are kept)
+    and delete its file. Returns the year, or None when nothing is archived.
+    """
+    boundary = archived_before(conn)
+    if not boundary:
+        return None
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    from rollups import rebuild_rollups, rollups_built
+    year = int(boundary[:4]) - 1
+    path = year_path(archive_dir(conn), year)
+    with conn:
+        if os.path.exists(path):
+            table = pq.read_table(path)
+            conn.executemany("""
+                INSERT OR IGNORE INTO streams (artist_id, region_id, metric_id, iso_date, count)
+                VALUES (?, ?, ?, ?, ?)
+            """, zip(*(table[name].to_pylist() for name in ("artist_id", "region_id", "metric_id")),
+                     pc.cast(table["iso_date"], pa.string()).to_pylist(), table["count"].to_pylist()))
+        if year > int(get_meta(conn, FIRST_KEY)[:4]):
+            set_meta(conn, BOUNDARY_KEY, f"{year}-01-01")
+        else:
+            conn.execute("DELETE FROM meta WHERE key IN (?, ?, ?)", (BOUNDARY_KEY, DIR_KEY, FIRST_KEY))
+    if os.path.exists(path):
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+    if rollups_built(conn):
+        print("Rebuilding rollups")
+        rebuild_rollups(conn)
+    return year
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Move years of streams older than a horizon into compressed Parquet files, or bring one back.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    parser.add_argument("--dir", help="Archive directory (default: <db>_archive next to the database)")
+    parser.add_argument("--horizon-days", type=int, default=ARCHIVE_HORIZON_DAYS,
+                        help="Days before the newest day that always stay in SQLite")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM afterwards so the file shrinks")
+    parser.add_argument("--restore", action="store_true", help="Move the newest archived year back into SQLite")
+    args = parser.parse_args(argv)
+
+    conn = db.connect(args.db)
+    try:
+        ensure_schema(conn)
+        t0 = time.perf_counter()
+        if args.restore:
+            year = restore_year(conn)
+            print(f"Restored {year}" if year else "Nothing is archived")
+        else:
+            root = args.dir or archive_dir(conn) or default_dir(args.db)
+            written = archive_streams(conn, root, args.horizon_days)
+            rows = sum(n for n, _ in written.values())
+            print(f"Archived {rows} rows from {len(written)} years to {root}; "
+                  f"streams now start {archived_before(conn) or 'where they did'}")
+        if args.vacuum:
+            before = os.path.getsize(args.db)
+            conn.execute("VACUUM")
+            print(f"Vacuumed: {before / (1024 * 1024):.1f} MB -> {os.path.getsize(args.db) / (1024 * 1024):.1f} MB")
+    finally:
+        conn.close()
+    print(f"Done in {time.perf_counter() - t0:.1f}s")
+
+if __name__ == "__main__":
+    main()
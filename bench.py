@@ -0,0 +1,189 @@
+import sqlite3
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import time
+from datetime import date, datetime
+
+import db
+import check_missing
+import demo
+import snapshot
+from bench_snapshots import snapshot_shapes
+from ingestion import ingest_files
+from rollups import rebuild_rollups
+from schema import ensure_schema
+from stream_coverage import rebuild_coverage
+from synth import build_synthetic_db, write_exports
+
+BENCH_DIR = "bench_data"
+REGRESSION_THRESHOLD = 0.20  # slower than the baseline median by more than this is a regression
+
+def prepare(args):
+    """Build (or reuse) the synthetic inputs for a scale and return their paths."""
+    scale = f"a{args.artists}_d{args.days}_g{args.gap_rate}"
+    root = os.path.join(args.dir, scale)
+    env = {
+        "root": root,
+        "db": os.path.join(root, "streams.db"),
+        "xlsx_dir": os.path.join(root, "xlsx"),
+        "start": date.fromisoformat(args.start),
+    }
+    if args.rebuild and os.path.isdir(root):
+        shutil.rmtree(root)
+    os.makedirs(root, exist_ok=True)
+
+    if not os.path.exists(env["db"]):
+        t0 = time.perf_counter()
+        build_synthetic_db(env["db"], args.artists, args.regions, env["start"], args.days, args.gap_rate)
+        conn = db.connect(env["db"])
+        with contextlib.redirect_stdout(io.StringIO()):
+            ensure_schema(conn)
+            rebuild_rollups(conn)
+            rebuild_coverage(conn)
+        conn.close()
+        print(f"Built {env['db']} in {time.perf_counter() - t0:.1f}s")
+    if not os.path.isdir(env["xlsx_dir"]):
+        t0 = time.perf_counter()
+        write_exports(env["xlsx_dir"], args.xlsx_artists, args.regions, env["start"], args.xlsx_days, args.gap_rate)
+        print(f"Wrote xlsx exports to {env['xlsx_dir']} in {time.perf_counter() - t0:.1f}s")
+    env["xlsx"] = sorted(os.path.join(env["xlsx_dir"], f) for f in os.listdir(env["xlsx_dir"]) if f.endswith(".xlsx"))
+    return env
+
+def remove(*paths):
+    for path in paths:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+def suite(env, args):
+    """
+    (name, setup, run) for every benchmark. setup is not timed and runs before each
+    repeat; run is timed.
+    """
+    conn = db.connect(env["db"], readonly=True)
+    end = date.fromisoformat(conn.execute("SELECT MAX(iso_date) FROM streams").fetchone()[0])
+    start = env["start"]
+    ingest_db = os.path.join(env["root"], "ingest.db")
+    demo_db = os.path.join(env["root"], "demo.db")
+
+    cases = [
+        ("ingest.xlsx",
+         lambda: remove(ingest_db),
+         lambda: ingest_files(env["xlsx"], db_path=ingest_db, force=True)),
+        ("gaps.rescan",
+         None,
+         lambda: list(check_missing.iter_gaps(conn, start, end, args.regions))),
+        ("gaps.coverage",
+         None,
+         lambda: list(check_missing.iter_coverage_gaps(conn, start, end, check_missing.region_map(conn, args.regions)))),
+    ]
+    # Snapshots compare every generated region, so --regions shows how they scale with it
+    for name, mode, cur_date, prev_date in snapshot_shapes(end):
+        cases.append((f"snapshot.{name}.raw", None,
+                      lambda m=mode, c=cur_date, p=prev_date: snapshot.fetch_snapshot(conn, m, c, p, args.regions, use_rollups=False)))
+        if mode in snapshot.ROLLUP_GRAINS:
+            cases.append((f"snapshot.{name}.rollups", None,
+                          lambda m=mode, c=cur_date, p=prev_date: snapshot.fetch_snapshot(conn, m, c, p, args.regions)))
+    cases.append(("demo.build",
+                  lambda: remove(demo_db),
+                  lambda: demo.build_demo(env["db"], demo_db, args.demo_mb)))
+    return conn, cases
+
+def run_suite(env, args):
+    conn, cases = suite(env, args)
+    results = {}
+    try:
+        for name, setup, run in cases:
+            if args.filter and not any(f in name for f in args.filter):
+                continue
+            timings = []
+            for _ in range(args.repeat):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    if setup:
+                        setup()
+                    t0 = time.perf_counter()
+                    run()
+                    timings.append(time.perf_counter() - t0)
+            results[name] = {
+                "median_s": round(statistics.median(timings), 4),
+                "min_s": round(min(timings), 4),
+                "repeat": len(timings),
+            }
+            print(f"  {name:26s} median {results[name]['median_s'] * 1000:10.1f} ms   min {results[name]['min_s'] * 1000:10.1f} ms")
+    finally:
+        conn.close()
+    return results
+
+def compare(results, baseline, threshold):
+    """Print each benchmark against the baseline; returns the names that regressed."""
+    regressed = []
+    print(f"Against baseline ({baseline['meta']['created_at']}):")
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"  {name:26s} new")
+            continue
+        ratio = result["median_s"] / max(before["median_s"], 1e-9)
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressed.append(name)
+        elif ratio < 1 - threshold:
+            flag = "  faster"
+        print(f"  {name:26s} {before['median_s'] * 1000:10.1f} ms -> {result['median_s'] * 1000:10.1f} ms  x{ratio:.2f}{flag}")
+    return regressed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time ingestion, gap checks, snapshots and the demo build on synthetic data.")
+    parser.add_argument("--dir", default=BENCH_DIR, help="Where synthetic inputs are generated and cached")
+    parser.add_argument("--artists", type=int, default=2000, help="Artists in the synthetic DB")
+    parser.add_argument("--days", type=int, default=730, help="Days in the synthetic DB")
+    parser.add_argument("--regions", nargs="+", default=["US", "Global"])
+    parser.add_argument("--start", default="2023-01-01", help="First synthetic date (YYYY-MM-DD)")
+    parser.add_argument("--gap-rate", type=float, default=0.002, help="Chance per day of a run of missing days")
+    parser.add_argument("--xlsx-artists", type=int, default=200, help="Artists per xlsx export")
+    parser.add_argument("--xlsx-days", type=int, default=90, help="Days per xlsx export")
+    parser.add_argument("--demo-mb", type=float, default=20, help="MAX_SIZE_MB for the demo build")
+    parser.add_argument("--rebuild", action="store_true", help="Regenerate the synthetic inputs")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--filter", nargs="+", help="Only run benchmarks whose name contains one of these")
+    parser.add_argument("--save", help="Write results as JSON to this path (e.g. a new baseline)")
+    parser.add_argument("--compare", help="Baseline JSON to compare against; exits 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    env = prepare(args)
+    print(f"Running benchmarks (repeat {args.repeat}):")
+    results = run_suite(env, args)
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "machine": platform.machine(),
+            "scale": {k: getattr(args, k) for k in ("artists", "days", "regions", "gap_rate", "xlsx_artists", "xlsx_days")},
+        },
+        "results": results,
+    }
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Written to: {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("scale") != report["meta"]["scale"]:
+            print("Warning: baseline was recorded at a different scale")
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
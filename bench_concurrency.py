@@ -0,0 +1,122 @@
+import sqlite3
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+import db
+import snapshot
+from schema import ensure_schema
+from synth import build_synthetic_db
+
+def check_concurrency(seconds=5.0, readers=4, artists=2000, days=365):
+    """
+    Run snapshot readers in threads while a writer rewrites a month of counts per
+    transaction (about one export file's worth) in the same synthetic DB, once with
+    sqlite3's default settings and once through db.connect(). Returns
+    {setting: {"reads", "read_errors", "writes", "write_errors", "p50_ms", "p95_ms"}}.
+    """
+    tmp = tempfile.mkdtemp(prefix="datamoney-concurrency-")
+    results = {}
+    try:
+        template = os.path.join(tmp, "template.db")
+        start = date(2023, 1, 1)
+        build_synthetic_db(template, artists, ["US", "Global"], start, days)
+        conn = sqlite3.connect(template)
+        with contextlib.redirect_stdout(io.StringIO()):
+            ensure_schema(conn)
+        conn.close()
+        end = start + timedelta(days=days - 1)
+
+        for setting in ("sqlite3 defaults", "db.connect"):
+            path = os.path.join(tmp, "streams.db")
+            shutil.copy(template, path)
+            if setting == "sqlite3 defaults":
+                open_reader = lambda: sqlite3.connect(path)
+                open_writer = lambda: sqlite3.connect(path)
+                sqlite3.connect(path).execute("PRAGMA journal_mode = DELETE").fetchone()
+            else:
+                open_reader = lambda: db.connect(path, readonly=True)
+                open_writer = lambda: db.connect(path)
+                db.connect(path).close()  # switches the file to WAL before the readers open it
+
+            stop = threading.Event()
+            stats = {"reads": 0, "read_errors": 0, "writes": 0, "write_errors": 0, "latencies": []}
+            stats_lock = threading.Lock()
+
+            def reader():
+                conn = open_reader()
+                while not stop.is_set():
+                    t0 = time.perf_counter()
+                    try:
+                        snapshot.fetch_snapshot(conn, "Weekly Streams", end, end - timedelta(days=7), use_rollups=False)
+                    except sqlite3.OperationalError:
+                        with stats_lock:
+                            stats["read_errors"] += 1
+                        continue
+                    with stats_lock:
+                        stats["reads"] += 1
+                        stats["latencies"].append((time.perf_counter() - t0) * 1000)
+                conn.close()
+
+            def writer():
+                conn = open_writer()
+                n = 0
+                while not stop.is_set():
+                    n += 1
+                    try:
+                        with conn:
+                            conn.execute("""
+                                UPDATE streams SET count = count + 1
+                                WHERE region_id = ? AND iso_date BETWEEN ? AND ?
+                            """, (n % 2 + 1, (end - timedelta(days=29)).isoformat(), end.isoformat()))
+                        with stats_lock:
+                            stats["writes"] += 1
+                    except sqlite3.OperationalError:
+                        with stats_lock:
+                            stats["write_errors"] += 1
+                conn.close()
+
+            threads = [threading.Thread(target=reader) for _ in range(readers)] + [threading.Thread(target=writer)]
+            for thread in threads:
+                thread.start()
+            time.sleep(seconds)
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+            latencies = sorted(stats.pop("latencies")) or [0.0]
+            stats["p50_ms"] = round(statistics.median(latencies), 1)
+            stats["p95_ms"] = round(latencies[int(len(latencies) * 0.95)], 1)
+            results[setting] = stats
+            os.remove(path)
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+    finally:
+        shutil.rmtree(tmp)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run snapshot readers alongside a writer on a synthetic DB and report lock errors.")
+    parser.add_argument("--seconds", type=float, default=5.0, help="How long each configuration runs")
+    parser.add_argument("--readers", type=int, default=4, help="Reader threads")
+    args = parser.parse_args(argv)
+
+    results = check_concurrency(args.seconds, args.readers)
+    print(f"{'':18s} {'reads':>7s} {'errors':>7s} {'writes':>7s} {'errors':>7s} {'p50 ms':>8s} {'p95 ms':>8s}")
+    for setting, s in results.items():
+        print(f"{setting:18s} {s['reads']:7d} {s['read_errors']:7d} {s['writes']:7d} {s['write_errors']:7d} "
+              f"{s['p50_ms']:8.1f} {s['p95_ms']:8.1f}")
+    if results["db.connect"]["read_errors"] or results["db.connect"]["write_errors"]:
+        raise SystemExit("lock errors with the shared settings")
+
+if __name__ == "__main__":
+    main()
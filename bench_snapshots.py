@@ -0,0 +1,120 @@
+import argparse
+import json
+import os
+import statistics
+import time
+from datetime import date, timedelta
+
+import db
+import perf
+import snapshot
+from schema import INDEXES, ensure_schema
+from synth import build_synthetic_db
+
+BENCH_DB = "bench_snapshots.db"
+
+SNAPSHOT_SQL = """
+SELECT a.name as artist, SUM(s.count) as total_streams
+FROM streams s
+JOIN artists a ON s.artist_id = a.artist_id
+JOIN regions r ON s.region_id = r.region_id
+WHERE r.name = ? AND s.iso_date BETWEEN ? AND ?
+GROUP BY a.name
+"""
+
+def snapshot_shapes(end):
+    """(name, app mode, current date, lookback date) for each app mode, ending at the given date."""
+    prev_month_end = end.replace(day=1) - timedelta(days=1)
+    return [
+        ("daily", "Daily Streams", end, end - timedelta(days=7)),
+        ("weekly", "Weekly Streams", end, end - timedelta(days=7)),
+        ("monthly", "Monthly Streams", end, prev_month_end),
+        ("yearly", "Yearly Streams", end, date(end.year - 1, 1, 1)),
+    ]
+
+def time_call(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - t0) * 1000)
+    return timings
+
+def per_region_render(conn, cur_range, prev_range):
+    """The four per-region, per-period queries the app used to issue for each page render."""
+    for region in ("US", "Global"):
+        for lo, hi in (cur_range, prev_range):
+            conn.execute(SNAPSHOT_SQL, (region, lo.isoformat(), hi.isoformat())).fetchall()
+
+def run_phase(conn, end, repeat):
+    results = {}
+    for name, mode, cur_date, prev_date in snapshot_shapes(end):
+        cur_range, prev_range = snapshot.period_ranges(mode, cur_date, prev_date)
+        # The plan of the statement the app runs, not of the per-region legacy query
+        plan = perf.query_plan(conn, *snapshot.snapshot_queries(conn, mode, cur_date, prev_date)[0])
+        timings = time_call(lambda: per_region_render(conn, cur_range, prev_range), repeat)
+        engine_timings = time_call(lambda: snapshot.fetch_snapshot(conn, mode, cur_date, prev_date), repeat)
+        results[name] = {
+            "plan": plan,
+            "median_ms": round(statistics.median(timings), 2),
+            "min_ms": round(min(timings), 2),
+            "engine_median_ms": round(statistics.median(engine_timings), 2),
+        }
+        print(f"  {name:8s} median {results[name]['median_ms']:9.2f} ms   min {results[name]['min_ms']:9.2f} ms"
+              f"   snapshot engine {results[name]['engine_median_ms']:9.2f} ms")
+        for line in plan:
+            print(f"           {line}")
+    return results
+
+def drop_indexes(conn):
+    for name in INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    conn.commit()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the app's snapshot queries on a synthetic DB.")
+    parser.add_argument("--db", default=BENCH_DB, help="Synthetic database path (built if missing)")
+    parser.add_argument("--artists", type=int, default=2000)
+    parser.add_argument("--regions", nargs="+", default=["US", "Global", "UK"])
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--start", default="2023-01-01", help="First synthetic date (YYYY-MM-DD)")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the synthetic DB even if it exists")
+    parser.add_argument("--baseline", action="store_true", help="Also time the queries with the indexes dropped")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    start = date.fromisoformat(args.start)
+    if args.rebuild and os.path.exists(args.db):
+        os.remove(args.db)
+    if not os.path.exists(args.db):
+        rows = args.artists * len(args.regions) * args.days
+        print(f"Building synthetic DB {args.db} ({rows:,} stream rows)")
+        t0 = time.perf_counter()
+        build_synthetic_db(args.db, args.artists, args.regions, start, args.days)
+        print(f"  built in {time.perf_counter() - t0:.1f}s")
+
+    conn = db.connect(args.db)
+    end = date.fromisoformat(conn.execute("SELECT MAX(iso_date) FROM streams").fetchone()[0])
+    results = {}
+    try:
+        if args.baseline:
+            print("Without indexes:")
+            drop_indexes(conn)
+            results["baseline"] = run_phase(conn, end, args.repeat)
+
+        t0 = time.perf_counter()
+        ensure_schema(conn)
+        print(f"Schema/indexes ensured in {time.perf_counter() - t0:.1f}s")
+        print("With indexes:")
+        results["indexed"] = run_phase(conn, end, args.repeat)
+    finally:
+        conn.close()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Written to: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,268 @@
-import sqlite3
-from datetime import datetime, timedelta
+from datetime import datetime, date
+from itertools import groupby
+import argparse
 import csv
 
+import archive
+import db
+from schema import ensure_schema
+from stream_coverage import coverage_built, rebuild_coverage
+
 DB_PATH = "/Users/georgeharrison/Desktop/ARTIST STAT PROJECT/data-money/datamoney.db"
 OUTPUT_CSV = "/Users/georgeharrison/Desktop/ARTIST STAT PROJECT/data-money/missing_streams.csv"
 
 START_DATE = datetime(2023, 1, 1)
 END_DATE = datetime(2025, 9, 18)
+REGIONS = ["US", "Global"]
 
-def daterange(start, end):
-    current = start
-    while current <= end:
-        yield current
-        current += timedelta(days=1)
+def find_gaps(days, start, end):
+    """Yield (gap_start, gap_end) ordinal ranges in [start, end] not covered by days."""
+    expected = start
+    for day in sorted(days):
+        if day < start or day > end:
+            continue
+        if day > expected:
+            yield expected, day - 1
+        expected = day + 1
+    if expected <= end:
+        yield expected, end
 
-def main():
-    conn = sqlite3.connect(DB_PATH)
+def iter_gaps(conn, start, end, regions):
+    """
+    Yield (artist_name, region_name, gap_start, gap_end) for every missing date range.
+    Streams is read once, ordered by (artist, region), so each date set is built a single time.
+    Days moved to the archive are added from its runs of consecutive days.
+    """
     cur = conn.cursor()
 
-    # Get all artists
-    cur.execute("SELECT artist_id, name FROM artists")
-    artists = cur.fetchall()
+    artists = dict(cur.execute("SELECT artist_id, name FROM artists").fetchall())
+    region_ids = {}
+    for region_id, name in cur.execute("SELECT region_id, name FROM regions"):
+        if name in regions:
+            region_ids[region_id] = name
+    if not region_ids:
+        return
+
+    start_ord = start.toordinal()
+    end_ord = end.toordinal()
+    parsed = {}  # iso date -> ordinal; there are only ~1k distinct dates
+
+    archived = {}  # (artist_id, region_id) -> [(first, last)] archived runs
+    for artist_id, region_id, lo, hi in archive.coverage_runs(conn, region_ids, start.isoformat(), end.isoformat()):
+        archived.setdefault((artist_id, region_id), []).append((lo, hi))
+    hot_start = max(start.isoformat(), archive.archived_before(conn) or "")
+
+    placeholders = ",".join("?" * len(region_ids))
+    rows = cur.execute(f"""
+        SELECT artist_id, region_id, iso_date FROM streams
+        WHERE region_id IN ({placeholders}) AND iso_date BETWEEN ? AND ?
+        ORDER BY artist_id, region_id
+    """, list(region_ids) + [hot_start, end.isoformat()])
+
+    seen = set()
+    for (artist_id, region_id), group in groupby(rows, key=lambda r: (r[0], r[1])):
+        seen.add((artist_id, region_id))
+        if artist_id not in artists:
+            continue
+        days = set()
+        for _, _, date_str in group:
+            day = parsed.get(date_str)
+            if day is None:
+                day = parsed[date_str] = date.fromisoformat(date_str).toordinal()
+            days.add(day)
+        for lo, hi in archived.pop((artist_id, region_id), ()):
+            days.update(range(lo, hi + 1))
+        for gap_start, gap_end in find_gaps(days, start_ord, end_ord):
+            yield artists[artist_id], region_ids[region_id], gap_start, gap_end
+
+    # Pairs whose only rows in the range are archived
+    for (artist_id, region_id), runs in archived.items():
+        seen.add((artist_id, region_id))
+        if artist_id not in artists:
+            continue
+        days = {day for lo, hi in runs for day in range(lo, hi + 1)}
+        for gap_start, gap_end in find_gaps(days, start_ord, end_ord):
+            yield artists[artist_id], region_ids[region_id], gap_start, gap_end
+
+    # Artist/region pairs with no rows at all are missing the whole calendar
+    for artist_id, artist_name in artists.items():
+        for region_id, region_name in region_ids.items():
+            if (artist_id, region_id) not in seen:
+                yield artist_name, region_name, start_ord, end_ord
+
+def region_map(conn, regions):
+    return {region_id: name for region_id, name in conn.execute("SELECT region_id, name FROM regions") if name in regions}
+
+def iter_coverage_gaps(conn, start, end, region_ids):
+    """
+    Yield (artist_id, region_id, gap_start, gap_end) from the stream_coverage intervals
+    instead of the stream rows: one row per covered interval, not per day.
+    """
+    start_ord = start.toordinal()
+    end_ord = end.toordinal()
+    placeholders = ",".join("?" * len(region_ids))
+    rows = conn.execute(f"""
+        SELECT artist_id, region_id, start_date, end_date FROM stream_coverage
+        WHERE region_id IN ({placeholders}) AND start_date <= ? AND end_date >= ?
+        ORDER BY artist_id, region_id, start_date
+    """, list(region_ids) + [end.isoformat(), start.isoformat()])
 
-    # Get region IDs
-    cur.execute("SELECT region_id, name FROM regions")
-    regions = {name: region_id for region_id, name in cur.fetchall()}
+    seen = set()
+    for (artist_id, region_id), group in groupby(rows, key=lambda r: (r[0], r[1])):
+        seen.add((artist_id, region_id))
+        expected = start_ord
+        for _, _, lo, hi in group:
+            lo = date.fromisoformat(lo).toordinal()
+            if lo > expected:
+                yield artist_id, region_id, expected, lo - 1
+            expected = max(expected, date.fromisoformat(hi).toordinal() + 1)
+        if expected <= end_ord:
+            yield artist_id, region_id, expected, end_ord
 
-    missing_records = []
+    # Artist/region pairs with no rows at all are missing the whole calendar
+    for (artist_id,) in conn.execute("SELECT artist_id FROM artists"):
+        for region_id in region_ids:
+            if (artist_id, region_id) not in seen:
+                yield artist_id, region_id, start_ord, end_ord
 
-    for artist_id, artist_name in artists:
-        for region_name in ["US", "Global"]:
-            region_id = regions.get(region_name)
-            if not region_id:
-                continue
+def sync_gap_log(conn, gaps, checked_at, region_ids, start, end):
+    """
+    Reconcile the open gaps in stream_gaps with the gaps found now. Only open gaps of the
+    checked regions that overlap the checked start..end window are compared, clipped to
+    that window the same way the new gaps are. A gap is identified by (artist, region,
+    first missing day): new ones are opened with first_seen, ones that disappeared are
+    closed with filled_at, and a changed last day inside the window is updated in place.
+    Returns (opened, filled).
+    """
+    lo_iso, hi_iso = start.isoformat(), end.isoformat()
+    current = {(a, r, date.fromordinal(lo).isoformat()): date.fromordinal(hi).isoformat() for a, r, lo, hi in gaps}
+    placeholders = ",".join("?" * len(region_ids))
+    open_gaps = {}  # clipped (artist, region, start) -> (stored start, stored end)
+    for a, r, s, e in conn.execute(f"""
+        SELECT artist_id, region_id, start_date, end_date FROM stream_gaps
+        WHERE filled_at IS NULL AND region_id IN ({placeholders}) AND start_date <= ? AND end_date >= ?
+    """, [*region_ids, hi_iso, lo_iso]):
+        open_gaps[(a, r, max(s, lo_iso))] = (s, e)
 
-            for single_date in daterange(START_DATE, END_DATE):
-                date_str = single_date.strftime("%m/%d/%Y")
-                cur.execute("""
-                    SELECT 1 FROM streams
-                    WHERE artist_id = ? AND region_id = ? AND date = ?
-                """, (artist_id, region_id, date_str))
-                if not cur.fetchone():
-                    missing_records.append((artist_name, region_name, date_str))
+    opened = [(a, r, s, e, checked_at) for (a, r, s), e in current.items() if (a, r, s) not in open_gaps]
+    filled = [(checked_at, a, r, open_gaps[(a, r, s)][0]) for (a, r, s) in open_gaps if (a, r, s) not in current]
+    moved = [(e, a, r, open_gaps[(a, r, s)][0]) for (a, r, s), e in current.items()
+             if (a, r, s) in open_gaps and min(open_gaps[(a, r, s)][1], hi_iso) != e]
+    with conn:
+        conn.executemany("""
+            UPDATE stream_gaps SET filled_at = ?
+            WHERE artist_id = ? AND region_id = ? AND start_date = ? AND filled_at IS NULL
+        """, filled)
+        conn.executemany("""
+            UPDATE stream_gaps SET end_date = ?
+            WHERE artist_id = ? AND region_id = ? AND start_date = ? AND filled_at IS NULL
+        """, moved)
+        conn.executemany("""
+            INSERT INTO stream_gaps (artist_id, region_id, start_date, end_date, first_seen) VALUES (?, ?, ?, ?, ?)
+        """, opened)
+    return len(opened), len(filled)
 
-    conn.close()
+def write_changes(conn, since, region_ids, start, end, output_csv):
+    """
+    Write the gaps of the checked regions and start..end window opened or filled at or
+    after `since`, one row per gap. Returns the number of gaps.
+    """
+    placeholders = ",".join("?" * len(region_ids))
+    rows = conn.execute(f"""
+        SELECT a.name, g.region_id, g.start_date, g.end_date,
+               CASE WHEN g.filled_at >= ? THEN 'filled' ELSE 'new' END
+        FROM stream_gaps g
+        JOIN artists a ON a.artist_id = g.artist_id
+        WHERE (g.first_seen >= ? OR g.filled_at >= ?) AND g.region_id IN ({placeholders})
+          AND g.start_date <= ? AND g.end_date >= ?
+        ORDER BY a.name, g.region_id, g.start_date
+    """, [since, since, since] + list(region_ids) + [end.isoformat(), start.isoformat()]).fetchall()
 
-    # Write all missing records to CSV
-    with open(OUTPUT_CSV, "w", newline="") as f:
+    with open(output_csv, "w", newline="") as f:
         writer = csv.writer(f)
-        writer.writerow(["artist_name", "region", "date"])
-        writer.writerows(missing_records)
+        writer.writerow(["artist_name", "region", "start_date", "end_date", "days", "status"])
+        for artist_name, region_id, lo, hi, status in rows:
+            lo, hi = date.fromisoformat(lo), date.fromisoformat(hi)
+            writer.writerow([
+                artist_name, region_ids[region_id],
+                lo.strftime("%m/%d/%Y"), hi.strftime("%m/%d/%Y"),
+                (hi - lo).days + 1, status,
+            ])
+    return len(rows)
+
+def write_missing(gaps, output_csv, ranges=False):
+    """Stream gaps to CSV, one row per missing day (or per gap range). Returns the number of missing days."""
+    total = 0
+    with open(output_csv, "w", newline="") as f:
+        writer = csv.writer(f)
+        if ranges:
+            writer.writerow(["artist_name", "region", "start_date", "end_date", "days"])
+        else:
+            writer.writerow(["artist_name", "region", "date"])
+
+        for artist_name, region_name, gap_start, gap_end in gaps:
+            days = gap_end - gap_start + 1
+            total += days
+            if ranges:
+                writer.writerow([
+                    artist_name, region_name,
+                    date.fromordinal(gap_start).strftime("%m/%d/%Y"),
+                    date.fromordinal(gap_end).strftime("%m/%d/%Y"),
+                    days,
+                ])
+            else:
+                writer.writerows(
+                    (artist_name, region_name, date.fromordinal(d).strftime("%m/%d/%Y"))
+                    for d in range(gap_start, gap_end + 1)
+                )
+    return total
+
+def check_coverage(conn, start, end, args):
+    """Gaps from the coverage table; records what changed in the gap log before writing the report."""
+    ensure_schema(conn)
+    if not coverage_built(conn):
+        print("Building coverage intervals (first run only)")
+        rebuild_coverage(conn)
+
+    region_ids = region_map(conn, args.regions)
+    gaps = list(iter_coverage_gaps(conn, start, end, region_ids)) if region_ids else []
+    opened, filled = sync_gap_log(conn, gaps, datetime.now().isoformat(timespec="seconds"), region_ids, start, end)
+    print(f"Gap log: {opened} new, {filled} filled since the last check")
+
+    if args.since:
+        n = write_changes(conn, args.since, region_ids, start, end, args.output)
+        print(f"Check complete. Gaps opened or filled since {args.since}: {n}")
+    else:
+        artists = dict(conn.execute("SELECT artist_id, name FROM artists"))
+        named = ((artists[a], region_ids[r], lo, hi) for a, r, lo, hi in gaps)
+        total = write_missing(named, args.output, ranges=args.ranges)
+        print(f"Check complete. Total missing records: {total}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report artist/region days missing from the streams table.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    parser.add_argument("--output", default=OUTPUT_CSV, help="CSV file to write")
+    parser.add_argument("--start", default=START_DATE.strftime("%Y-%m-%d"), help="First date to check (YYYY-MM-DD)")
+    parser.add_argument("--end", default=END_DATE.strftime("%Y-%m-%d"), help="Last date to check (YYYY-MM-DD)")
+    parser.add_argument("--regions", nargs="+", default=REGIONS, help="Region names to check")
+    parser.add_argument("--ranges", action="store_true", help="Write one row per gap range instead of per day")
+    parser.add_argument("--since", help="Only write gaps opened or filled since this date/time (YYYY-MM-DD[THH:MM:SS])")
+    parser.add_argument("--rescan", action="store_true", help="Derive gaps from every stream row instead of the coverage table")
+    args = parser.parse_args(argv)
+
+    start = datetime.strptime(args.start, "%Y-%m-%d").date()
+    end = datetime.strptime(args.end, "%Y-%m-%d").date()
 
-    print(f"Check complete. Total missing records: {len(missing_records)}")
-    print(f"Written to: {OUTPUT_CSV}")
+    conn = db.connect(args.db)
+    try:
+        if args.rescan:
+            total = write_missing(iter_gaps(conn, start, end, args.regions), args.output, ranges=args.ranges)
+            print(f"Check complete. Total missing records: {total}")
+        else:
+            check_coverage(conn, start, end, args)
+    finally:
+        conn.close()
+    print(f"Written to: {args.output}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
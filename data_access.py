@@ -0,0 +1,236 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import pandas as pd
+import streamlit as st
+
+import alerts
+import archive
+import db
+import perf
+import snapshot
+from rollups import rollups_built
+from schema import has_table
+
+SNAPSHOT_TTL = 15 * 60      # seconds a cached snapshot may be served
+SNAPSHOT_CACHE_SIZE = 64    # most recent (mode, ranges, regions, metrics) snapshots kept
+SERIES_CACHE_SIZE = 256     # most recent artist drill-down series kept
+PARQUET_ROOT = os.environ.get("DATAMONEY_PARQUET_ROOT")  # optional Parquet export to answer snapshots from
+SHOW_PERF_PANEL = os.environ.get("DATAMONEY_PERF_PANEL", "1") != "0"  # sidebar timing breakdown
+READ_WORKERS = 4            # threads (each with its own read connection) running queries
+PREFETCH_SIZE = 8           # adjacent-period snapshots kept ready in the background
+ALERTS_LIMIT = 500          # strongest alerts of each kind shown for a period
+
+# Streamlit serves every session from its own thread; guards the shared watermark connection
+# and the prefetch table
+_lock = threading.Lock()
+
+perf.show_plans(SHOW_PERF_PANEL)
+
+# Queries run on a small pool of long-lived threads, each holding its own read-only connection
+# (db.get). With the database in WAL mode (every db.connect writer sets it) readers never wait
+# for the ingestion writer, and the script thread only waits on results. Prefetches are orchestrated from a
+# separate single thread so they can never occupy every query worker while waiting on them.
+_pools = {}
+_pools_lock = threading.Lock()
+_prefetched = OrderedDict()  # snapshot key -> Future
+
+def _pool(name, workers):
+    with _pools_lock:
+        if name not in _pools:
+            _pools[name] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"datamoney-{name}")
+        return _pools[name]
+
+def submit(db_path, fn, *args):
+    """Run fn(connection, *args) on a read worker, with that worker's read-only connection; returns a Future."""
+    return _pool("read", READ_WORKERS).submit(lambda: fn(db.get(db_path, readonly=True), *args))
+
+def read(db_path, fn, *args):
+    return submit(db_path, fn, *args).result()
+
+def _fetchall(conn, sql, params):
+    return conn.execute(sql, params).fetchall()
+
+@st.cache_resource
+def get_connection(db_path):
+    """
+    One read-only connection per database, reused across reruns and sessions. Only used
+    for the watermark: PRAGMA data_version is only comparable on the same connection.
+    """
+    return db.connect(db_path, readonly=True, check_same_thread=False)
+
+def ingestion_watermark(db_path):
+    """
+    Changes whenever the database does: the last completed ingestion plus SQLite's
+    data_version, which moves on every commit made by another connection.
+    Used as a cache key so cached dates and snapshots are dropped after new data lands.
+    """
+    conn = get_connection(db_path)
+    with _lock:
+        last_ingest = None
+        if has_table(conn, "ingest_manifest"):
+            last_ingest = conn.execute("SELECT MAX(finished_at) FROM ingest_manifest").fetchone()[0]
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    return (id(conn), last_ingest, data_version)
+
+def _read_dates(conn):
+    date_min, date_max = conn.execute("SELECT MIN(iso_date), MAX(iso_date) FROM streams").fetchone()
+    if rollups_built(conn):
+        months = [m for (m,) in conn.execute("SELECT DISTINCT period FROM stream_rollups WHERE grain = 'month'")]
+    else:
+        months = [m for (m,) in conn.execute("SELECT DISTINCT substr(iso_date, 1, 7) FROM streams")]
+    # Archived history stays selectable; its snapshots are read from the year files
+    archived = archive.archived_range(conn)
+    if archived:
+        date_min = min(date_min or archived[0], archived[0])
+        months = sorted(set(months) | set(archive.archived_months(conn)))
+    return date_min, date_max, months
+
+@st.cache_data(show_spinner=False)
+def _date_index(db_path, watermark):
+    date_min, date_max, months = read(db_path, _read_dates)
+    months = sorted(months, reverse=True)
+    return {
+        "date_min": date.fromisoformat(date_min),
+        "date_max": date.fromisoformat(date_max),
+        "years": sorted({int(m[:4]) for m in months}, reverse=True),
+        "months": [pd.to_datetime(m, format="%Y-%m").strftime("%B %Y") for m in months],
+    }
+
+def load_date_index(db_path):
+    """min/max date, years and 'Month YYYY' labels (newest first), recomputed only after new data."""
+    return _date_index(db_path, ingestion_watermark(db_path))
+
+def _read_names(conn):
+    return (
+        [name for (name,) in conn.execute("SELECT name FROM regions ORDER BY name")],
+        [name for (name,) in conn.execute("SELECT name FROM metrics ORDER BY name")],
+    )
+
+@st.cache_data(show_spinner=False)
+def _dimensions(db_path, watermark):
+    regions, metrics = read(db_path, _read_names)
+    return {"regions": regions, "metrics": metrics}
+
+def load_dimensions(db_path):
+    """Region and metric names that can be compared, recomputed only after new data."""
+    return _dimensions(db_path, ingestion_watermark(db_path))
+
+def compute_snapshot(db_path, mode, cur_date, prev_date, regions=snapshot.REGIONS, metrics=snapshot.METRICS):
+    """
+    snapshot.fetch_snapshot with the period aggregates (each over a share of the regions)
+    running concurrently on their own read connections. Safe to call from any thread.
+    """
+    if PARQUET_ROOT:
+        return read(db_path, snapshot.fetch_snapshot, mode, cur_date, prev_date, regions, metrics, True, PARQUET_ROOT)
+    queries = read(db_path, snapshot.snapshot_queries, mode, cur_date, prev_date, regions, metrics, True, READ_WORKERS)
+    plan = read(db_path, perf.query_plan, *queries[0]) if queries and perf.plans_wanted() else None
+    with perf.stage("snapshot.query", concurrent=len(queries), plan=plan) as record:
+        archived = submit(db_path, snapshot.archived_rows, mode, cur_date, prev_date, regions, metrics)
+        futures = [submit(db_path, _fetchall, sql, params) for sql, params in queries]
+        rows = [row for future in futures for row in future.result()] + archived.result()
+        record["rows"] = len(rows)
+    with perf.stage("snapshot.pivot"):
+        return snapshot.pivot_snapshot(snapshot.long_frame(rows), regions, metrics)
+
+@st.cache_data(ttl=SNAPSHOT_TTL, max_entries=SNAPSHOT_CACHE_SIZE, show_spinner=False)
+def _snapshot(db_path, mode, cur_range, prev_range, regions, metrics, watermark):
+    with _lock:
+        future = _prefetched.pop((db_path, mode, cur_range, prev_range, regions, metrics, watermark), None)
+    if future is not None:
+        try:
+            with perf.stage("snapshot.prefetched"):
+                return future.result()
+        except Exception:
+            pass  # computed again below, so the error (if any) surfaces in this rerun
+    # The end of each range identifies the period for every mode
+    return compute_snapshot(db_path, mode, cur_range[1], prev_range[1], regions, metrics)
+
+def fetch_snapshot(db_path, mode, cur_date, prev_date, regions=snapshot.REGIONS, metrics=snapshot.METRICS):
+    """Cached snapshot, keyed by the compared ranges, regions, metrics and the DB watermark."""
+    cur_range, prev_range = snapshot.period_ranges(mode, cur_date, prev_date)
+    return _snapshot(db_path, mode, cur_range, prev_range, tuple(regions), tuple(metrics), ingestion_watermark(db_path))
+
+def shift_month(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+def adjacent_dates(mode, cur_date, prev_date):
+    """The (current, lookback) dates one step before and after, keeping the same gap between them."""
+    if mode in ("Daily Streams", "Weekly Streams"):
+        step = timedelta(days=1 if mode == "Daily Streams" else 7)
+        return [(cur_date - step, prev_date - step), (cur_date + step, prev_date + step)]
+    if mode == "Monthly Streams":
+        return [(shift_month(cur_date, -1), shift_month(prev_date, -1)),
+                (shift_month(cur_date, 1), shift_month(prev_date, 1))]
+    if mode == "Yearly Streams":
+        return [(date(cur_date.year - 1, 1, 1), date(prev_date.year - 1, 1, 1)),
+                (date(cur_date.year + 1, 1, 1), date(prev_date.year + 1, 1, 1))]
+    return []
+
+def prefetch_adjacent(db_path, mode, cur_date, prev_date, date_min=None, date_max=None,
+                      regions=snapshot.REGIONS, metrics=snapshot.METRICS):
+    """
+    Start computing the snapshots one step either side of the current one in the
+    background, so stepping through periods is served without waiting on SQLite.
+    """
+    watermark = ingestion_watermark(db_path)
+    regions, metrics = tuple(regions), tuple(metrics)
+    for cur, prev in adjacent_dates(mode, cur_date, prev_date):
+        cur_range, prev_range = snapshot.period_ranges(mode, cur, prev)
+        if (date_max and cur_range[0] > date_max) or (date_min and prev_range[1] < date_min):
+            continue
+        key = (db_path, mode, cur_range, prev_range, regions, metrics, watermark)
+        with _lock:
+            if key in _prefetched:
+                continue
+            _prefetched[key] = _pool("prefetch", 1).submit(compute_snapshot, db_path, mode, cur, prev, regions, metrics)
+            while len(_prefetched) > PREFETCH_SIZE:
+                _prefetched.popitem(last=False)
+
+@st.cache_data(ttl=SNAPSHOT_TTL, max_entries=SERIES_CACHE_SIZE, show_spinner=False)
+def _artist_series(db_path, artist, regions, metrics, watermark):
+    return read(db_path, snapshot.artist_series, artist, regions, metrics)
+
+def fetch_artist_series(db_path, artist, regions=snapshot.REGIONS, metrics=snapshot.METRICS):
+    """Cached snapshot.artist_series for the drill-down chart, one entry per artist and selection."""
+    return _artist_series(db_path, artist, tuple(regions), tuple(metrics), ingestion_watermark(db_path))
+
+def _read_alerts(conn, lo, hi, regions, metrics):
+    if not alerts.alerts_built(conn):
+        return None  # alerts.py has not been run on this database
+    return alerts.load_alerts(conn, lo, hi, regions, metrics, ALERTS_LIMIT)
+
+@st.cache_data(ttl=SNAPSHOT_TTL, max_entries=SNAPSHOT_CACHE_SIZE, show_spinner=False)
+def _alerts(db_path, lo, hi, regions, metrics, watermark):
+    return read(db_path, _read_alerts, lo, hi, regions, metrics)
+
+def fetch_alerts(db_path, lo, hi, regions=snapshot.REGIONS, metrics=snapshot.METRICS):
+    """Stored spikes/breakouts dated lo..hi (ISO dates), or None when the alerts job has never run."""
+    return _alerts(db_path, lo, hi, tuple(regions), tuple(metrics), ingestion_watermark(db_path))
+
+def render_perf_panel():
+    """Sidebar expander with this rerun's stage timings, row counts and query plans."""
+    if not SHOW_PERF_PANEL:
+        return
+    stages = perf.records()
+    with st.sidebar.expander("Performance"):
+        if not stages:
+            st.caption("No stages recorded")
+            return
+        st.dataframe(
+            pd.DataFrame({
+                "Stage": ["\u2003" * r["depth"] + r["stage"] for r in stages],
+                "ms": [r["ms"] for r in stages],
+                "Rows": [r.get("rows") for r in stages],
+            }),
+            hide_index=True,
+        )
+        st.caption("Stages nested under a cached call only run on a cache miss.")
+        for r in stages:
+            if r.get("plan"):
+                st.caption(r["stage"])
+                st.code("\n".join(r["plan"]), language=None)
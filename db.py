@@ -0,0 +1,55 @@
+import sqlite3
+import os
+import pathlib
+import threading
+
+BUSY_TIMEOUT_MS = 5000           # how long a statement waits for a lock instead of failing
+CACHE_SIZE_KB = 64 * 1024        # page cache of a writing connection
+MMAP_SIZE = 256 * 1024 * 1024    # bytes of the file read through memory mapping
+
+# Every connection. temp_store stays at its default (files): with MEMORY the large snapshot
+# GROUP BY sorts measured 30-50% slower than through SQLite's own spilling sorter.
+# Readers share file pages through mmap (the OS page cache) instead of each holding a large
+# private cache_size.
+PRAGMAS = (
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    f"PRAGMA mmap_size = {MMAP_SIZE}",
+)
+# Writers: WAL is stored in the file, so once any writer has connected readers never block
+# on it (and it never blocks on them); NORMAL only syncs at checkpoints, which is safe in WAL.
+# The bigger page cache keeps index pages hot while a file's rows are upserted.
+WRITE_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    f"PRAGMA cache_size = -{CACHE_SIZE_KB}",
+)
+
+_local = threading.local()
+
+def connect(db_path, readonly=False, check_same_thread=True):
+    """
+    A new connection with the shared settings. Read-only connections open the file with a
+    mode=ro URI, so the apps can never write to it or take a write lock.
+    """
+    if readonly:
+        uri = pathlib.Path(db_path).resolve().as_uri() + "?mode=ro"  # '#', '?' and '%' in the path are escaped
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+    else:
+        conn = sqlite3.connect(db_path, check_same_thread=check_same_thread)
+        for pragma in WRITE_PRAGMAS:
+            conn.execute(pragma)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def get(db_path, readonly=False):
+    """
+    This thread's connection to db_path, opened on first use and then reused. A forked
+    process opens its own instead of sharing its parent's.
+    """
+    conns = _local.__dict__.setdefault("conns", {})
+    key = (os.path.abspath(db_path), readonly)
+    entry = conns.get(key)
+    if entry is None or entry[0] != os.getpid():
+        entry = conns[key] = (os.getpid(), connect(db_path, readonly))
+    return entry[1]
@@ -1,46 +1,144 @@
+import os
 import sqlite3
-import pandas as pd
+from datetime import date
+
+import db
+from alerts import alerts_built
+from rollups import rebuild_rollups, rollups_built
+from schema import create_tables, get_meta, has_column, set_meta
+from stream_coverage import coverage_built, rebuild_coverage
 
 SRC_DB = "datamoney.db"           # Your full DB
 DST_DB = "datamoney_demo.db"      # Demo DB to create
 MAX_SIZE_MB = 100                 # Target size for demo DB
+MAX_MONTHS = 12                   # Never keep more than this much history
+MAX_ATTEMPTS = 5                  # Cutoff adjustments before giving up on MAX_SIZE_MB
+
+# Tables that are rebuilt for the demo (rollups, coverage) or meaningless outside the source DB
+SKIP_TABLES = {"stream_rollups", "stream_coverage", "stream_gaps", "ingest_manifest", "meta"}
+# Tables cut at the same date as streams; alerts are kept as computed on the full history
+DATED_TABLES = ("streams", "alerts")
+
+def months_before(day, months):
+    year, month = divmod(day.year * 12 + day.month - 1 - months, 12)
+    month += 1
+    while True:
+        try:
+            return date(year, month, day.day)
+        except ValueError:
+            day = day.replace(day=day.day - 1)
+
+def file_mb(path):
+    return os.path.getsize(path) / (1024 * 1024)
+
+def day_counts(conn, schema="main"):
+    """[(iso_date, rows)] newest first; answered from the iso_date index."""
+    return conn.execute(f"""
+        SELECT iso_date, COUNT(*) FROM {schema}.streams
+        WHERE iso_date IS NOT NULL
+        GROUP BY iso_date
+        ORDER BY iso_date DESC
+    """).fetchall()
+
+def cutoff_for_rows(counts, max_rows, earliest):
+    """Earliest date such that the days from it to the newest day hold at most max_rows rows."""
+    cutoff = counts[0][0] if counts else earliest
+    total = 0
+    for iso_date, n in counts:
+        if iso_date < earliest or total + n > max_rows:
+            break
+        total += n
+        cutoff = iso_date
+    return cutoff
+
+def build_demo(src_db=SRC_DB, dst_db=DST_DB, max_size_mb=MAX_SIZE_MB):
+    # Read-only: building a demo never migrates or otherwise touches the source
+    src_conn = db.connect(src_db, readonly=True)
+    if not has_column(src_conn, "streams", "iso_date"):
+        src_conn.close()
+        raise SystemExit(f"{src_db} predates streams.iso_date: run schema.py (or migrate_keys.py) on it first")
+    counts = day_counts(src_conn)
+    total_rows = sum(n for _, n in counts)
+    has_rollups = rollups_built(src_conn)
+    has_coverage = coverage_built(src_conn)
+    alerts_built_at = get_meta(src_conn, "alerts_built_at") if alerts_built(src_conn) else None
+    src_conn.close()
+    if not counts:
+        raise SystemExit(f"No streams in {src_db}")
 
-# Connect to source DB
-src_conn = sqlite3.connect(SRC_DB)
-dst_conn = sqlite3.connect(DST_DB)
-
-# 1. Determine cutoff date so the demo DB stays under ~100 MB
-# We'll start by keeping only 2024 and 2025 data, drop 2023.
-# If still too big, we'll keep only the most recent few months
-dates_df = pd.read_sql("SELECT DISTINCT date FROM streams", src_conn)
-dates_df['date_dt'] = pd.to_datetime(dates_df['date'], format="%m/%d/%Y")
-dates_df = dates_df.sort_values('date_dt', ascending=False)
-
-# Start with the most recent 12 months
-cutoff_date = dates_df['date_dt'].max() - pd.DateOffset(months=12)
-print("Initial cutoff date:", cutoff_date.date())
-
-# 2. Copy tables to new DB
-tables = pd.read_sql("SELECT name FROM sqlite_master WHERE type='table'", src_conn)
-for t in tables['name']:
-    if t == 'streams':
-        # Keep only recent rows
-        df = pd.read_sql(f"SELECT * FROM {t}", src_conn)
-        df['date_dt'] = pd.to_datetime(df['date'], format="%m/%d/%Y")
-        df_demo = df[df['date_dt'] >= cutoff_date].drop(columns=['date_dt'])
-        print(f"{t}: keeping {len(df_demo)} rows")
-        df_demo.to_sql(t, dst_conn, index=False, if_exists='replace')
+    # 1. Determine cutoff date so the demo DB stays under MAX_SIZE_MB.
+    # Start with the most recent MAX_MONTHS and move the cutoff forward if the
+    # source's bytes-per-row says that would not fit.
+    earliest = months_before(date.fromisoformat(counts[0][0]), MAX_MONTHS).isoformat()
+    bytes_per_row = os.path.getsize(src_db) / max(total_rows, 1)
+    budget_rows = int(max_size_mb * 1024 * 1024 / bytes_per_row)
+    cutoff = cutoff_for_rows(counts, budget_rows, earliest)
+    print("Initial cutoff date:", cutoff)
+
+    # 2. Copy schema and rows inside SQLite; nothing passes through Python
+    if os.path.exists(dst_db):
+        os.remove(dst_db)
+    dst_conn = sqlite3.connect(dst_db)
+    dst_conn.execute("PRAGMA journal_mode = OFF")
+    dst_conn.execute("PRAGMA synchronous = OFF")
+    dst_conn.execute("ATTACH DATABASE ? AS src", (src_db,))
+
+    objects = dst_conn.execute("""
+        SELECT type, name, tbl_name, sql FROM src.sqlite_master
+        WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+    """).fetchall()
+    tables = [(name, sql) for type_, name, _, sql in objects if type_ == "table" and name not in SKIP_TABLES]
+    later = [sql for type_, _, tbl_name, sql in objects if type_ in ("index", "trigger") and tbl_name not in SKIP_TABLES]
+
+    with dst_conn:
+        for name, sql in tables:
+            dst_conn.execute(sql)
+            if name in DATED_TABLES:
+                cur = dst_conn.execute(f"INSERT INTO main.{name} SELECT * FROM src.{name} WHERE iso_date >= ?", (cutoff,))
+                print(f"{name}: keeping {cur.rowcount} rows")
+            else:
+                cur = dst_conn.execute(f"INSERT INTO main.{name} SELECT * FROM src.{name}")
+                print(f"{name}: copied {cur.rowcount} rows")
+        # Indexes and triggers after the bulk copy, so they are built once
+        for sql in later:
+            dst_conn.execute(sql)
+    # meta is not copied; the alerts rows are, so they stay marked as built
+    if alerts_built_at and "alerts" in dict(tables):
+        create_tables(dst_conn)
+        with dst_conn:
+            set_meta(dst_conn, "alerts_built_at", alerts_built_at)
+    dst_conn.execute("DETACH DATABASE src")
+
+    # 3. Enforce MAX_SIZE_MB: shrink the window by the measured overshoot until it fits
+    for attempt in range(MAX_ATTEMPTS):
+        if has_rollups:
+            rebuild_rollups(dst_conn)
+        if has_coverage:
+            rebuild_coverage(dst_conn)
+        dst_conn.execute("VACUUM")
+        size_mb = file_mb(dst_db)
+        print(f"Demo DB size with cutoff {cutoff}: {size_mb:.1f} MB")
+        if size_mb <= max_size_mb:
+            break
+
+        counts = day_counts(dst_conn)
+        kept_rows = sum(n for _, n in counts)
+        target_rows = int(kept_rows * (max_size_mb / size_mb) * 0.95)
+        new_cutoff = cutoff_for_rows(counts, target_rows, cutoff)
+        if new_cutoff <= cutoff:
+            new_cutoff = counts[max(len(counts) - 2, 0)][0]  # always drop at least the oldest day
+        with dst_conn:
+            for name in DATED_TABLES[1:]:
+                if name in dict(tables):
+                    dst_conn.execute(f"DELETE FROM {name} WHERE iso_date < ?", (new_cutoff,))
+            cur = dst_conn.execute("DELETE FROM streams WHERE iso_date < ?", (new_cutoff,))
+        print(f"Moved cutoff to {new_cutoff}, dropped {cur.rowcount} rows")
+        cutoff = new_cutoff
     else:
-        # Copy full table (artists, regions, etc.)
-        df = pd.read_sql(f"SELECT * FROM {t}", src_conn)
-        df.to_sql(t, dst_conn, index=False, if_exists='replace')
-        print(f"{t}: copied {len(df)} rows")
-
-dst_conn.close()
-src_conn.close()
-
-# Optional: run VACUUM to shrink demo DB
-conn = sqlite3.connect(DST_DB)
-conn.execute("VACUUM;")
-conn.close()
-print("Demo DB created:", DST_DB)
+        print(f"Warning: demo DB is still over {max_size_mb} MB")
+
+    dst_conn.close()
+    print("Demo DB created:", dst_db)
+
+if __name__ == "__main__":
+    build_demo()
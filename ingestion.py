@@ -1,10 +1,22 @@
-import sqlite3
+import argparse
+import hashlib
+import os
+import openpyxl
 import pandas as pd
+import time
 import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
+import db
+import perf
+from schema import ensure_schema, has_column, to_iso, uuid_keys
+from rollups import refresh_rollups
+from stream_coverage import refresh_coverage
 
 DB_PATH = "/Users/georgeharrison/Desktop/ARTIST STAT PROJECT/data-money/datamoney.db"
 
+DATE_ROW_IDX = 6  # 0-based row holding the date headers in each artist sheet
+
 def is_date_string(s):
     if pd.isna(s):
         return False
@@ -14,88 +26,354 @@ def is_date_string(s):
     except ValueError:
         return False
 
-def get_or_create_id(conn, table, id_column, name):
-    """Get id from table by name, or create a new UUID entry."""
-    cur = conn.cursor()
-    cur.execute(f"SELECT {id_column} FROM {table} WHERE name = ?", (name,))
-    row = cur.fetchone()
+def clean_value(value):
+    """Stream counts as plain Python numbers (sqlite3 can't bind numpy scalars), NaN as NULL."""
+    if pd.isna(value):
+        return None
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def open_workbook(file_path):
+    """Open an export in read-only mode: sheets are streamed row by row, never loaded whole."""
+    return openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+
+def read_region(wb):
+    """Country named on the "Report Summary" sheet, or "Unknown"."""
+    for ws in wb.worksheets:
+        if ws.title.lower() != "report summary":
+            continue
+        for row in ws.iter_rows(values_only=True):
+            if row and row[0] == "Country":
+                return row[1] if len(row) > 1 else "Unknown"
+    return "Unknown"
+
+def iter_sheet_records(ws, metrics=None):
+    """
+    Yield (artist, metric, date, value) for one artist sheet, reading it once: every metric
+    row under the date header row is taken, or only those named in `metrics`.
+    """
+    ws.reset_dimensions()
+    artist_name = None
+    date_cols = None
+    metric_rows = []
+    for idx, row in enumerate(ws.iter_rows(values_only=True)):
+        label = row[1] if len(row) > 1 else None
+        if artist_name is None and label == "Artist":
+            artist_name = str(row[2] if len(row) > 2 else None).strip()
+        if idx == DATE_ROW_IDX:
+            date_cols = [(i, val) for i, val in enumerate(row[2:], start=2) if is_date_string(val)]
+        elif idx > DATE_ROW_IDX and label is not None and (metrics is None or label in metrics):
+            # Notes or blank rows under the metrics have no values in the date columns
+            if any(c < len(row) and row[c] is not None for c, _ in date_cols or []):
+                metric_rows.append((str(label).strip(), row))
+            if metrics is not None and {name for name, _ in metric_rows} >= set(metrics):
+                break
+
+    if artist_name is None:
+        return
+    if not metric_rows:
+        print(f"  {artist_name}: no {' / '.join(metrics) if metrics else 'metric'} rows found.")
+        return
+    for metric_name, row in metric_rows:
+        for c, date in date_cols or []:
+            yield artist_name, metric_name, date, row[c] if c < len(row) else None
+
+def iter_records(wb, metrics=None):
+    """Yield (artist, metric, date, value) for every artist sheet of an open workbook, in one pass."""
+    for ws in wb.worksheets:
+        if ws.title.lower() == "report summary":
+            continue
+        yield from iter_sheet_records(ws, metrics)
+
+UPSERT_SQL = """
+    INSERT INTO streams (artist_id, region_id, metric_id, iso_date, count)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (artist_id, region_id, metric_id, iso_date)
+    DO UPDATE SET count = excluded.count
+"""
+UPSERT_UUID_SQL = """
+    INSERT INTO streams (stream_id, artist_id, region_id, metric_id, date, iso_date, count)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (artist_id, region_id, metric_id, iso_date)
+    DO UPDATE SET count = excluded.count, date = excluded.date
+"""
+
+def load_id_map(conn, table, id_column):
+    """name -> id for a whole lookup table, so sheets never query it row by row."""
+    return {name: id_ for id_, name in conn.execute(f"SELECT {id_column}, name FROM {table}")}
+
+def get_or_create_id(conn, table, id_column, name, id_map=None):
+    """
+    Get id from table by name, or create a new entry: an integer key, or a new UUID in a
+    database that has not been through migrate_keys.py. Does not commit.
+    """
+    if id_map is not None and name in id_map:
+        return id_map[name]
+    row = conn.execute(f"SELECT {id_column} FROM {table} WHERE name = ?", (name,)).fetchone()
     if row:
-        return row[0]
-    new_id = str(uuid.uuid4())
-    cur.execute(f"INSERT INTO {table} ({id_column}, name) VALUES (?, ?)", (new_id, name))
-    conn.commit()
+        new_id = row[0]
+    elif has_column(conn, table, "uuid"):
+        new_id = conn.execute(f"INSERT INTO {table} (name) VALUES (?)", (name,)).lastrowid
+    else:
+        new_id = str(uuid.uuid4())
+        conn.execute(f"INSERT INTO {table} ({id_column}, name) VALUES (?, ?)", (new_id, name))
+    if id_map is not None:
+        id_map[name] = new_id
     return new_id
 
-def ingest_file(file_path):
-    conn = sqlite3.connect(DB_PATH)
-    xls = pd.ExcelFile(file_path, engine="openpyxl")
+def extract_file(file_path, metrics=None):
+    """
+    Parse one workbook into (region_name, [(artist, metric, date, value), ...]).
+    Touches no database, so it can run in a worker process.
+    """
+    wb = open_workbook(file_path)
+    try:
+        return read_region(wb), list(iter_records(wb, metrics))
+    finally:
+        wb.close()
 
-    # --- STEP 1: get region ---
-    summary_df = pd.read_excel(file_path, sheet_name="Report Summary", engine="openpyxl", header=None)
-    country_row = summary_df[summary_df.iloc[:, 0] == "Country"]
-    region_name = country_row.iloc[0, 1] if not country_row.empty else "Unknown"
-    region_id = get_or_create_id(conn, "regions", "region_id", region_name)
-    print(f"Region: {region_name}")
+def load_id_maps(conn):
+    return {
+        "artists": load_id_map(conn, "artists", "artist_id"),
+        "regions": load_id_map(conn, "regions", "region_id"),
+        "metrics": load_id_map(conn, "metrics", "metric_id"),
+    }
 
-    # --- STEP 2: get metric ---
-    metric_name = "Streaming On-Demand Audio"
-    metric_id = get_or_create_id(conn, "metrics", "metric_id", metric_name)
+def write_records(conn, id_maps, region_name, records, manifest_path=None):
+    """
+    Upsert one file's extracted records, every metric included, in a single transaction;
+    the file's manifest entry is marked done in that same transaction. Returns the number
+    of stream rows.
+    """
+    with conn:
+        # --- STEP 1: get region ---
+        region_id = get_or_create_id(conn, "regions", "region_id", region_name, id_maps["regions"])
+        print(f"Region: {region_name}")
 
-    # --- STEP 3: loop artist sheets ---
-    for sheet in xls.sheet_names:
-        if sheet.lower() == "report summary":
-            continue
+        # --- STEP 2: resolve artists and metrics (cached in id_maps) and build rows ---
+        legacy = uuid_keys(conn)  # UUID databases also store a stream_id and the original date string
+        rows = []
+        touched = {}  # artist_id -> ISO dates written for it
+        artist_name = None
+        metric_name = None
+        for name, metric, date, value in records:
+            if name != artist_name:
+                artist_name = name
+                artist_id = get_or_create_id(conn, "artists", "artist_id", artist_name, id_maps["artists"])
+                artist_dates = touched.setdefault(artist_id, set())
+                print(f"Processing artist: {artist_name}")
+            if metric != metric_name:
+                metric_name = metric
+                metric_id = get_or_create_id(conn, "metrics", "metric_id", metric_name, id_maps["metrics"])
+            iso_date = to_iso(date)
+            if legacy:
+                rows.append((str(uuid.uuid4()), artist_id, region_id, metric_id, date, iso_date, clean_value(value)))
+            else:
+                rows.append((artist_id, region_id, metric_id, iso_date, clean_value(value)))
+            artist_dates.add(iso_date)
+        touched_dates = set().union(*touched.values())
 
-        df = pd.read_excel(file_path, sheet_name=sheet, header=None, engine="openpyxl")
+        # --- STEP 3: upsert all rows of the file at once on the natural key ---
+        with perf.stage("ingest.upsert", rows=len(rows)):
+            conn.executemany(UPSERT_UUID_SQL if legacy else UPSERT_SQL, rows)
 
-        # artist
-        artist_row = df[df[1] == "Artist"]
-        if artist_row.empty:
-            continue
-        artist_name = str(artist_row.iloc[0, 2]).strip()
-        artist_id = get_or_create_id(conn, "artists", "artist_id", artist_name)
-        print(f"Processing artist: {artist_name}")
-
-        # date columns
-        date_row_idx = 6
-        raw_dates = df.iloc[date_row_idx, 2:].tolist()
-        date_cols = [i for i, val in enumerate(raw_dates, start=2) if is_date_string(val)]
-        dates = [df.iat[date_row_idx, c] for c in date_cols]
-
-        # stream values
-        sod_row = df[df[1] == metric_name]
-        if sod_row.empty:
-            print("  No Streaming On-Demand Audio row found.")
-            continue
-        sod_values = [sod_row.iat[0, c] for c in date_cols]
+        # --- STEP 4: update week/month/year rollups for the periods we touched ---
+        with perf.stage("ingest.rollups", days=len(touched_dates)):
+            refresh_rollups(conn, [(artist_id, region_id) for artist_id in touched], touched_dates)
+
+        # --- STEP 5: extend the covered date intervals the gap check reads ---
+        with perf.stage("ingest.coverage", pairs=len(touched)):
+            refresh_coverage(conn, {(artist_id, region_id): days for artist_id, days in touched.items()})
+
+        if manifest_path is not None:
+            conn.execute("""
+                UPDATE ingest_manifest
+                SET status = 'done', row_count = ?, finished_at = ?, error = NULL
+                WHERE path = ?
+            """, (len(rows), now(), manifest_path))
+    return len(rows)
+
+def now():
+    return datetime.now().isoformat(timespec="seconds")
 
-        print(f"Processing artist: {artist_name}")
-        print(f"Raw date columns: {raw_dates}")
-        print(f"Detected date columns: {dates}")
-        print(f"Stream values: {sod_values}")
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-        # --- insert into streams table ---
-        cur = conn.cursor()
-        for date, value in zip(dates, sod_values):
+def register_batch(conn, file_paths, batch_id):
+    """Record every file of a batch up front so an interrupted run knows what was left."""
+    with conn:
+        conn.executemany("""
+            INSERT INTO ingest_manifest (path, status, batch_id) VALUES (?, 'pending', ?)
+            ON CONFLICT (path) DO UPDATE SET batch_id = excluded.batch_id
+        """, [(path, batch_id) for path in file_paths])
+
+def unfinished_files(conn):
+    """Files of the most recent batch that have not completed."""
+    return [path for (path,) in conn.execute("""
+        SELECT path FROM ingest_manifest
+        WHERE batch_id = (SELECT MAX(batch_id) FROM ingest_manifest) AND status != 'done'
+        ORDER BY path
+    """)]
+
+def needs_ingest(conn, file_path, force=False):
+    """
+    Decide from the manifest whether a file has to be (re)loaded. An unchanged size and
+    mtime skips it without reading it; otherwise the content hash decides. With `force`
+    the file is always loaded, but its size, mtime and hash are still recorded so the
+    next normal run can skip it.
+    """
+    stat = os.stat(file_path)
+    row = conn.execute("SELECT sha256, size, mtime, status FROM ingest_manifest WHERE path = ?",
+                       (file_path,)).fetchone()
+    if not force and row and row[3] == "done" and row[1] == stat.st_size and row[2] == stat.st_mtime:
+        return False
+
+    sha256 = file_sha256(file_path)
+    same = None if force else conn.execute("""
+        SELECT row_count FROM ingest_manifest WHERE sha256 = ? AND status = 'done' LIMIT 1
+    """, (sha256,)).fetchone()
+    with conn:
+        if same:
+            conn.execute("""
+                UPDATE ingest_manifest
+                SET sha256 = ?, size = ?, mtime = ?, row_count = ?, status = 'done'
+                WHERE path = ?
+            """, (sha256, stat.st_size, stat.st_mtime, same[0], file_path))
+            return False
+        conn.execute("""
+            UPDATE ingest_manifest
+            SET sha256 = ?, size = ?, mtime = ?, status = 'started', started_at = ?, finished_at = NULL
+            WHERE path = ?
+        """, (sha256, stat.st_size, stat.st_mtime, now(), file_path))
+    return True
+
+def mark_failed(conn, file_path, error):
+    with conn:
+        conn.execute("UPDATE ingest_manifest SET status = 'failed', error = ? WHERE path = ?",
+                     (str(error), file_path))
+
+def ingest_file(file_path, force=False):
+    """Load one workbook in a single transaction. Returns the number of stream rows written."""
+    return ingest_files([file_path], force=force)[0]
+
+def timed_extract(file_path, metrics=None):
+    with perf.stage("ingest.parse", file=file_path) as record:
+        region_name, records = extract_file(file_path, metrics)
+        record["rows"] = len(records)
+    return region_name, records, record["ms"] / 1000
+
+def ingest_files(file_paths, workers=1, db_path=None, force=False, resume=False, metrics=None):
+    """
+    Ingest many workbooks. Parsing is spread over a process pool of `workers`; this process
+    is the only SQLite writer and commits once per file. A file that fails to parse or write
+    is reported and skipped without affecting the others. Every metric row of each artist
+    sheet is loaded, or only the names in `metrics`.
+
+    Files already loaded with the same content are skipped (unless `force`). With `resume`,
+    the unfinished files of the last batch are added to `file_paths`.
+    Returns (rows written, list of failed paths).
+    """
+    started = time.perf_counter()
+    conn = db.connect(db_path or DB_PATH)
+    ensure_schema(conn)
+    id_maps = load_id_maps(conn)
+
+    file_paths = [os.path.abspath(path) for path in file_paths]
+    if resume:
+        pending = [path for path in unfinished_files(conn) if path not in file_paths]
+        print(f"Resuming {len(pending)} unfinished files from the last batch")
+        file_paths += pending
+    register_batch(conn, file_paths, datetime.now().isoformat())
+
+    total_rows = 0
+    failed = []
+    skipped = 0
+    done = 0
+
+    def fail(file_path, error):
+        nonlocal done
+        done += 1
+        failed.append(file_path)
+        mark_failed(conn, file_path, error)
+        # The rollback also undid any artists/regions/metrics the file created
+        id_maps.update(load_id_maps(conn))
+        print(f"[{done}/{len(file_paths)}] {file_path}: FAILED: {error}")
+
+    def write(file_path, region_name, records, parse_seconds):
+        nonlocal total_rows, done
+        with perf.stage("ingest.write", file=file_path) as record:
+            n_rows = write_records(conn, id_maps, region_name, records, manifest_path=file_path)
+            record["rows"] = n_rows
+        total_rows += n_rows
+        done += 1
+        print(f"[{done}/{len(file_paths)}] {file_path}: {n_rows} rows "
+              f"(parse {parse_seconds:.1f}s, write {record['ms'] / 1000:.1f}s)")
+
+    try:
+        # Decide what to load before any parsing starts
+        to_load = []
+        for file_path in file_paths:
             try:
-                cur.execute("""
-                    INSERT OR IGNORE INTO streams (stream_id, artist_id, region_id, metric_id, date, count)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (str(uuid.uuid4()), artist_id, region_id, metric_id, date, value))
+                if needs_ingest(conn, file_path, force):
+                    to_load.append(file_path)
+                else:
+                    skipped += 1
+                    done += 1
+                    print(f"[{done}/{len(file_paths)}] {file_path}: unchanged, skipped")
             except Exception as e:
-                print(f"Error inserting {artist_name} {date}: {e}")
-        conn.commit()
+                fail(file_path, e)
 
-    conn.close()
-    print("Ingestion complete.")
+        if workers <= 1:
+            for file_path in to_load:
+                print(f"Ingesting file: {file_path}")
+                try:
+                    write(file_path, *timed_extract(file_path, metrics))
+                except Exception as e:
+                    fail(file_path, e)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(timed_extract, file_path, metrics): file_path for file_path in to_load}
+                for future in as_completed(futures):
+                    file_path = futures[future]
+                    try:
+                        write(file_path, *future.result())
+                    except Exception as e:
+                        fail(file_path, e)
+    finally:
+        conn.close()
 
-if __name__ == "__main__":
-    import sys
+    elapsed = time.perf_counter() - started
+    loaded = len(file_paths) - len(failed) - skipped
+    print(f"Ingested {total_rows} rows from {loaded} files in {elapsed:.1f}s "
+          f"({total_rows / elapsed:,.0f} rows/s, {workers} worker{'s' if workers != 1 else ''}), "
+          f"{skipped} unchanged files skipped")
+    if failed:
+        print(f"{len(failed)} files failed:")
+        for file_path in failed:
+            print(f"  {file_path}")
+    return total_rows, failed
 
-    if len(sys.argv) < 2:
-        print("Usage: python3 ingestion.py file1.xlsx [file2.xlsx ...]")
-        sys.exit(1)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest streaming exports into the datamoney database.")
+    parser.add_argument("files", nargs="*", metavar="file.xlsx")
+    parser.add_argument("--workers", type=int, default=1, help="Processes used to parse workbooks in parallel")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    parser.add_argument("--force", action="store_true", help="Reload files even if the manifest says they are unchanged")
+    parser.add_argument("--resume", action="store_true", help="Also load the unfinished files of the last batch")
+    parser.add_argument("--metrics", nargs="+", help="Only load these metric rows (default: every metric in the sheet)")
+    args = parser.parse_args()
+    if not args.files and not args.resume:
+        parser.error("give at least one file, or --resume")
 
-    for file_path in sys.argv[1:]:
-        print(f"Ingesting file: {file_path}")
-        ingest_file(file_path)
\ No newline at end of file
+    profiler = perf.start_profile()
+    _, failed = ingest_files(args.files, args.workers, args.db, force=args.force, resume=args.resume, metrics=args.metrics)
+    perf.dump_profile(profiler, "ingestion")
+    if failed:
+        raise SystemExit(1)
@@ -0,0 +1,155 @@
+import sqlite3
+import argparse
+import os
+import statistics
+import time
+from datetime import date
+
+import db
+import check_missing
+import snapshot
+from bench_snapshots import snapshot_shapes, time_call
+from rollups import rebuild_rollups, rollups_built
+from schema import DB_PATH, create_tables, ensure_schema, uuid_keys
+from stream_coverage import coverage_built, rebuild_coverage
+
+LOOKUPS = (("artists", "artist_id"), ("regions", "region_id"), ("metrics", "metric_id"))
+REPEAT = 5
+
+def size_report(conn, path):
+    """File size and the bytes actually used by pages (file size minus free pages), in MB."""
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    pages = conn.execute("PRAGMA page_count").fetchone()[0]
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return {
+        "file_mb": os.path.getsize(path) / (1024 * 1024),
+        "used_mb": (pages - free) * page_size / (1024 * 1024),
+    }
+
+def latencies(conn, repeat=REPEAT):
+    """Median ms of the raw snapshot query per app mode, one artist's history and a full gap scan."""
+    lo, hi = conn.execute("SELECT MIN(iso_date), MAX(iso_date) FROM streams").fetchone()
+    start, end = date.fromisoformat(lo), date.fromisoformat(hi)
+    artist = conn.execute("SELECT name FROM artists ORDER BY name LIMIT 1").fetchone()[0]
+
+    calls = [
+        (f"snapshot {name}", lambda m=mode, c=cur, p=prev: snapshot.fetch_snapshot(conn, m, c, p, use_rollups=False))
+        for name, mode, cur, prev in snapshot_shapes(end)
+    ]
+    calls.append(("artist series", lambda: snapshot.artist_series(conn, artist)))
+    calls.append(("gap scan", lambda: list(check_missing.iter_gaps(conn, start, end, snapshot.REGIONS))))
+    return {name: statistics.median(time_call(fn, repeat)) for name, fn in calls}
+
+def copy_database(src_db, dst_db):
+    """
+    Write src_db (UUID keys) into a new dst_db with integer keys. Lookup ids are assigned
+    in UUID order, so reading streams through the old natural-key index yields rows already
+    in the new primary-key order and the WITHOUT ROWID table is filled without page splits.
+    """
+    dst = sqlite3.connect(dst_db)
+    dst.execute("PRAGMA journal_mode = OFF")
+    dst.execute("PRAGMA synchronous = OFF")
+    create_tables(dst)
+    dst.execute("ATTACH DATABASE ? AS src", (src_db,))
+    src_tables = {name for (name,) in dst.execute("SELECT name FROM src.sqlite_master WHERE type = 'table'")}
+
+    with dst:
+        for table, id_column in LOOKUPS:
+            cur = dst.execute(f"INSERT INTO main.{table} (name, uuid) SELECT name, {id_column} FROM src.{table} ORDER BY {id_column}")
+            dst.execute(f"CREATE UNIQUE INDEX ux_{table}_uuid ON {table}(uuid)")
+            print(f"{table}: {cur.rowcount} rows")
+
+        t0 = time.perf_counter()
+        cur = dst.execute("""
+            INSERT INTO main.streams (artist_id, region_id, metric_id, iso_date, count)
+            SELECT a.artist_id, r.region_id, m.metric_id, s.iso_date, s.count
+            FROM src.streams s
+            JOIN main.artists a ON a.uuid = s.artist_id
+            JOIN main.regions r ON r.uuid = s.region_id
+            JOIN main.metrics m ON m.uuid = s.metric_id
+            WHERE s.iso_date IS NOT NULL
+            ORDER BY s.artist_id, s.region_id, s.metric_id, s.iso_date
+        """)
+        print(f"streams: {cur.rowcount} rows in {time.perf_counter() - t0:.1f}s")
+
+        if "stream_gaps" in src_tables:
+            dst.execute("""
+                INSERT INTO main.stream_gaps (artist_id, region_id, start_date, end_date, first_seen, filled_at)
+                SELECT a.artist_id, r.region_id, g.start_date, g.end_date, g.first_seen, g.filled_at
+                FROM src.stream_gaps g
+                JOIN main.artists a ON a.uuid = g.artist_id
+                JOIN main.regions r ON r.uuid = g.region_id
+            """)
+        if "alerts" in src_tables:
+            dst.execute("""
+                INSERT INTO main.alerts (iso_date, region_id, metric_id, kind, artist_id, value, baseline, score)
+                SELECT al.iso_date, r.region_id, m.metric_id, al.kind, a.artist_id, al.value, al.baseline, al.score
+                FROM src.alerts al
+                JOIN main.artists a ON a.uuid = al.artist_id
+                JOIN main.regions r ON r.uuid = al.region_id
+                JOIN main.metrics m ON m.uuid = al.metric_id
+            """)
+        for table in ("ingest_manifest", "meta"):
+            if table in src_tables:
+                dst.execute(f"INSERT INTO main.{table} SELECT * FROM src.{table}")
+        # Derived tables are rebuilt below, not copied
+        dst.execute("DELETE FROM main.meta WHERE key IN ('rollups_built_at', 'coverage_built_at')")
+    dst.execute("DETACH DATABASE src")
+    return dst
+
+def migrate(src_db, dst_db):
+    src = db.connect(src_db)
+    if not uuid_keys(src):
+        src.close()
+        raise SystemExit(f"{src_db} already uses integer keys")
+    print("Bringing the source schema up to date")
+    ensure_schema(src)  # backfilled iso_date, no duplicate natural keys
+    skipped = src.execute("SELECT COUNT(*) FROM streams WHERE iso_date IS NULL").fetchone()[0]
+    had_rollups, had_coverage = rollups_built(src), coverage_built(src)
+    before = {**size_report(src, src_db), **latencies(src)}
+    src_rows = src.execute("SELECT COUNT(*), SUM(count) FROM streams WHERE iso_date IS NOT NULL").fetchone()
+    src.close()
+
+    if os.path.exists(dst_db):
+        os.remove(dst_db)
+    dst = copy_database(src_db, dst_db)
+    try:
+        if had_rollups:
+            print("Rebuilding rollups")
+            rebuild_rollups(dst)
+        if had_coverage:
+            print("Rebuilding coverage")
+            rebuild_coverage(dst)
+        ensure_schema(dst)
+        dst.execute("VACUUM")
+        dst.execute("PRAGMA journal_mode = WAL")
+
+        dst_rows = dst.execute("SELECT COUNT(*), SUM(count) FROM streams").fetchone()
+        if tuple(dst_rows) != tuple(src_rows):
+            raise SystemExit(f"Row check failed: source {src_rows}, migrated {dst_rows}")
+        after = {**size_report(dst, dst_db), **latencies(dst)}
+    finally:
+        dst.close()
+
+    if skipped:
+        print(f"{skipped} rows without a parseable date were not copied")
+    print(f"\n{'':20s} {'before':>12s} {'after':>12s}")
+    for key in before:
+        unit = "MB" if key.endswith("_mb") else "ms"
+        print(f"{key:20s} {before[key]:9.1f} {unit} {after[key]:9.1f} {unit}   x{after[key] / max(before[key], 1e-9):.2f}")
+    return before, after
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Rewrite a UUID-keyed datamoney DB with integer keys and a WITHOUT ROWID streams table.")
+    parser.add_argument("--db", default=DB_PATH, help="Source database (left as it is apart from schema.py's upgrades)")
+    parser.add_argument("--out", help="Migrated database to write (default: <db>_intkeys.db)")
+    args = parser.parse_args(argv)
+
+    out = args.out or os.path.splitext(args.db)[0] + "_intkeys.db"
+    migrate(args.db, out)
+    print(f"\nMigrated database written to: {out}")
+    print("Stop the apps and ingestion, then replace the old file with it.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import sqlite3
+import argparse
+import os
+import shutil
+import time
+from datetime import date
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+import db
+from schema import DB_PATH
+
+PARQUET_ROOT = "streams_parquet"
+LOOKUPS = {"artists": "artist_id", "regions": "region_id", "metrics": "metric_id"}
+LOOKUP_DIR = "_lookups"  # the leading underscore keeps it out of the streams dataset
+
+def month_partitions(lo, hi):
+    """(year, month) pairs covering the ISO date range lo..hi."""
+    year, month = int(lo[:4]), int(lo[5:7])
+    last = (int(hi[:4]), int(hi[5:7]))
+    months = []
+    while (year, month) <= last:
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+def partition_dir(root, year, month):
+    return os.path.join(root, f"year={year}", f"month={month:02d}")
+
+def streams_table(rows):
+    """
+    (artist_id, region_id, metric_id, iso_date, count) rows -> Arrow table with
+    dictionary-encoded id columns and a date32 iso_date.
+    """
+    artist_ids, region_ids, metric_ids, iso_dates, counts = zip(*rows)
+    # ids are integers, or UUID strings in a database not yet through migrate_keys.py
+    return pa.table({
+        "artist_id": pa.array(artist_ids).dictionary_encode(),
+        "region_id": pa.array(region_ids).dictionary_encode(),
+        "metric_id": pa.array(metric_ids).dictionary_encode(),
+        "iso_date": pa.array(iso_dates, pa.string()).cast(pa.date32()),
+        "count": pa.array(counts, pa.int64()),
+    })
+
+def export_streams(conn, root=PARQUET_ROOT, start=None, end=None, compression="snappy"):
+    """
+    Write streams as one Parquet file per month under root/year=YYYY/month=MM/, with
+    dictionary-encoded id columns and a date32 iso_date. Existing months in the range are
+    replaced. Lookup tables are written next to them. Returns the number of rows written.
+    """
+    lo, hi = conn.execute("SELECT MIN(iso_date), MAX(iso_date) FROM streams").fetchone()
+    if lo is None:
+        return 0
+    lo = max(lo, start) if start else lo
+    hi = min(hi, end) if end else hi
+
+    total = 0
+    for year, month in month_partitions(lo, hi):
+        t0 = time.perf_counter()
+        month_key = f"{year}-{month:02d}"
+        rows = conn.execute("""
+            SELECT artist_id, region_id, metric_id, iso_date, count FROM streams
+            WHERE iso_date BETWEEN ? AND ?
+            ORDER BY region_id, iso_date, artist_id
+        """, (f"{month_key}-01", f"{month_key}-31")).fetchall()
+
+        out_dir = partition_dir(root, year, month)
+        if os.path.isdir(out_dir):
+            shutil.rmtree(out_dir)
+        if not rows:
+            continue
+
+        os.makedirs(out_dir)
+        pq.write_table(streams_table(rows), os.path.join(out_dir, "part-0.parquet"), compression=compression)
+        total += len(rows)
+        print(f"  {month_key}: {len(rows)} rows in {time.perf_counter() - t0:.1f}s")
+
+    os.makedirs(os.path.join(root, LOOKUP_DIR), exist_ok=True)
+    for table_name, id_column in LOOKUPS.items():
+        lookup = pd.read_sql(f"SELECT {id_column}, name FROM {table_name}", conn)
+        pq.write_table(pa.Table.from_pandas(lookup, preserve_index=False),
+                       os.path.join(root, LOOKUP_DIR, f"{table_name}.parquet"))
+    return total
+
+def open_dataset(root=PARQUET_ROOT):
+    """The partitioned streams dataset, read through memory-mapped files."""
+    return ds.dataset(
+        root,
+        format="parquet",
+        partitioning="hive",
+        filesystem=fs.LocalFileSystem(use_mmap=True),
+    )
+
+def read_lookup(root, table_name):
+    return pq.read_table(os.path.join(root, LOOKUP_DIR, f"{table_name}.parquet")).to_pandas()
+
+def range_totals(dataset, lo, hi, region_ids, metric_ids):
+    """
+    SUM(count) per (artist_id, region_id, metric_id) for lo..hi, reading only those months'
+    files and columns (those years' files in a dataset partitioned by year only).
+    """
+    if "month" in dataset.schema.names:
+        partitions = [(ds.field("year") == year) & (ds.field("month") == month) for year, month in month_partitions(lo, hi)]
+    else:
+        partitions = [ds.field("year") == year for year in range(int(lo[:4]), int(hi[:4]) + 1)]
+    partition_filter = partitions[0]
+    for expr in partitions[1:]:
+        partition_filter = partition_filter | expr
+    row_filter = (
+        partition_filter
+        & (ds.field("iso_date") >= pa.scalar(date.fromisoformat(lo), pa.date32()))
+        & (ds.field("iso_date") <= pa.scalar(date.fromisoformat(hi), pa.date32()))
+        & ds.field("region_id").isin(pa.array(region_ids))
+        & ds.field("metric_id").isin(pa.array(metric_ids))
+    )
+    keys = ["artist_id", "region_id", "metric_id"]
+    table = dataset.to_table(columns=[*keys, "count"], filter=row_filter)
+    for i, name in enumerate(keys):
+        column = table[name]
+        if pa.types.is_dictionary(column.type):  # string ids come back dictionary-encoded
+            table = table.set_column(i, name, pc.cast(column, column.type.value_type))
+    return table.group_by(keys).aggregate([("count", "sum")]).to_pandas()
+
+def name_map(source, table_name, names=None):
+    """
+    {id: name} from a lookup table, limited to the given names. source is an export root
+    (its lookup files) or a SQLite connection (archive.py reads the hot DB's tables).
+    """
+    if isinstance(source, sqlite3.Connection):
+        lookup = pd.read_sql(f"SELECT {LOOKUPS[table_name]}, name FROM {table_name}", source)
+    else:
+        lookup = read_lookup(source, table_name)
+    if names is not None:
+        lookup = lookup[lookup["name"].isin(names)]
+    return dict(zip(lookup[LOOKUPS[table_name]], lookup["name"]))
+
+def fetch_totals(root, periods, regions, metrics):
+    """
+    (artist, region, metric, period, total) rows for each (period, lo, hi), the same long
+    shape the SQLite snapshot query returns.
+    """
+    dataset = open_dataset(root)
+    region_map = name_map(root, "regions", regions)
+    metric_map = name_map(root, "metrics", metrics)
+    artist_map = name_map(root, "artists")
+
+    frames = []
+    for period, lo, hi in periods:
+        totals = range_totals(dataset, lo, hi, list(region_map), list(metric_map))
+        frames.append(pd.DataFrame({
+            "artist": totals["artist_id"].map(artist_map),
+            "region": totals["region_id"].map(region_map),
+            "metric": totals["metric_id"].map(metric_map),
+            "period": period,
+            "total": totals["count_sum"],
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export streams to date-partitioned Parquet files.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    parser.add_argument("--out", default=PARQUET_ROOT, help="Output directory")
+    parser.add_argument("--start", help="First date to export (YYYY-MM-DD)")
+    parser.add_argument("--end", help="Last date to export (YYYY-MM-DD)")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    conn = db.connect(args.db, readonly=True)
+    try:
+        total = export_streams(conn, args.out, args.start, args.end)
+    finally:
+        conn.close()
+    print(f"Exported {total} rows to {args.out} in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()
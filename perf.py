@@ -0,0 +1,93 @@
+import cProfile
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+PROFILE_ENV = "DATAMONEY_PROFILE"    # directory; when set, profiled runs dump cProfile stats there
+LOG_ENV = "DATAMONEY_PERF_LOG"       # file; when set, every stage is appended to it as a JSON line
+
+logger = logging.getLogger("datamoney.perf")
+if os.environ.get(LOG_ENV):
+    _handler = logging.FileHandler(os.environ[LOG_ENV])
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+# Stages are collected per thread: Streamlit runs each session's rerun in its own thread.
+# Threads that never call reset() (e.g. query workers) only log their stages.
+_local = threading.local()
+_show_plans = False  # set through show_plans() by an app whose panel displays query plans
+
+def reset():
+    """Start collecting a new breakdown in this thread (call at the top of each rerun)."""
+    _local.records = []
+    _local.depth = 0
+
+def records():
+    """Stages finished in this thread since the last reset(), in start order."""
+    return sorted(getattr(_local, "records", []), key=lambda r: r["start"])
+
+@contextlib.contextmanager
+def stage(name, **fields):
+    """
+    Time a block. Yields the stage's record, so the block can add fields such as
+    record["rows"]; nested stages are recorded with their depth. Each finished stage
+    is logged as one JSON object.
+    """
+    depth = getattr(_local, "depth", 0)
+    record = {"stage": name, "depth": depth, "start": time.perf_counter(), **fields}
+    _local.depth = depth + 1
+    try:
+        yield record
+    finally:
+        _local.depth = depth
+        record["ms"] = round((time.perf_counter() - record["start"]) * 1000, 2)
+        collected = getattr(_local, "records", None)
+        if collected is not None:
+            collected.append(record)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({k: v for k, v in record.items() if k != "start"}, default=str))
+
+def query_plan(conn, sql, params=()):
+    """SQLite's EXPLAIN QUERY PLAN for a statement, one line per step."""
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+
+def show_plans(enabled=True):
+    """Have plans_wanted() hold for the stages this process's threads collect."""
+    global _show_plans
+    _show_plans = enabled
+
+def plans_wanted():
+    """
+    True when a query plan would be seen: stages are logged, or this thread collects
+    them for a panel that shows plans. Otherwise the EXPLAIN round trip is skipped.
+    """
+    collecting = getattr(_local, "records", None) is not None
+    return logger.isEnabledFor(logging.INFO) or (_show_plans and collecting)
+
+def plan(conn, sql, params=()):
+    """query_plan() for a stage's record when plans_wanted(), else None."""
+    return query_plan(conn, sql, params) if plans_wanted() else None
+
+def start_profile():
+    """A running cProfile.Profile when PROFILE_ENV is set, else None."""
+    if not os.environ.get(PROFILE_ENV):
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+def dump_profile(profiler, name):
+    """Stop a profile from start_profile() and write it to PROFILE_ENV/<name>-<time>.prof."""
+    if profiler is None:
+        return None
+    profiler.disable()
+    out_dir = os.environ[PROFILE_ENV]
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"{name}-{datetime.now():%Y%m%d-%H%M%S-%f}.prof")
+    profiler.dump_stats(path)
+    return path
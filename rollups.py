@@ -0,0 +1,120 @@
+import argparse
+import calendar
+import time
+from datetime import date, datetime, timedelta
+
+import archive
+import db
+from schema import DB_PATH, create_tables, ensure_schema, get_meta, set_meta
+
+GRAINS = ("week", "month", "year")
+
+# SQL expression giving each grain's period key for streams.iso_date
+PERIOD_SQL = {
+    "week": "date(s.iso_date, '-' || ((CAST(strftime('%w', s.iso_date) AS INTEGER) + 6) % 7) || ' days')",
+    "month": "substr(s.iso_date, 1, 7)",
+    "year": "substr(s.iso_date, 1, 4)",
+}
+
+def period_key(grain, day):
+    """Period key of a date: Monday's ISO date for weeks, 'YYYY-MM' for months, 'YYYY' for years."""
+    if grain == "week":
+        return (day - timedelta(days=day.weekday())).isoformat()
+    if grain == "month":
+        return day.strftime("%Y-%m")
+    if grain == "year":
+        return day.strftime("%Y")
+    raise ValueError(f"Unknown grain: {grain}")
+
+def period_bounds(grain, key):
+    """First and last ISO date covered by a period key."""
+    if grain == "week":
+        start = date.fromisoformat(key)
+        return start.isoformat(), (start + timedelta(days=6)).isoformat()
+    if grain == "month":
+        year, month = int(key[:4]), int(key[5:7])
+        return f"{key}-01", f"{key}-{calendar.monthrange(year, month)[1]:02d}"
+    if grain == "year":
+        return f"{key}-01-01", f"{key}-12-31"
+    raise ValueError(f"Unknown grain: {grain}")
+
+def rollups_built(conn):
+    """Rollups are only complete (and safe to read) after a full rebuild."""
+    return get_meta(conn, "rollups_built_at") is not None
+
+def rebuild_rollups(conn):
+    """
+    Recompute every week/month/year total from streams. Periods starting before the archive
+    boundary are left out: snapshots read those from the archive, along with rows ingested
+    for them since.
+    """
+    create_tables(conn)
+    conn.execute("DELETE FROM stream_rollups")
+    boundary = archive.archived_before(conn) or ""
+    for grain in GRAINS:
+        t0 = time.perf_counter()
+        # The boundary is a January 1st, so only a week can start before it and end after it
+        first_day = PERIOD_SQL[grain] if grain == "week" else "s.iso_date"
+        cur = conn.execute(f"""
+            INSERT INTO stream_rollups (grain, period, region_id, artist_id, metric_id, total, days)
+            SELECT ?, {PERIOD_SQL[grain]}, s.region_id, s.artist_id, s.metric_id, SUM(s.count), COUNT(*)
+            FROM streams s
+            WHERE {first_day} >= ?
+            GROUP BY 2, s.region_id, s.artist_id, s.metric_id
+        """, (grain, boundary))
+        print(f"  {grain}: {cur.rowcount} rows in {time.perf_counter() - t0:.1f}s")
+    set_meta(conn, "rollups_built_at", datetime.now().isoformat(timespec="seconds"))
+    conn.commit()
+
+def refresh_rollups(conn, pairs, iso_dates):
+    """
+    Recompute rollups for only the periods touched by iso_dates and only for the given
+    (artist_id, region_id) pairs, skipping periods that start before the archive boundary.
+    Does nothing until the rollups have been fully built.
+    Does not commit; callers commit together with the stream rows.
+    """
+    if not pairs or not iso_dates or not rollups_built(conn):
+        return
+
+    # Untyped columns, so the ids keep their type (integer or UUID text) and match the streams index
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS rollup_pairs (artist_id, region_id)")
+    conn.execute("DELETE FROM temp.rollup_pairs")
+    conn.executemany("INSERT INTO temp.rollup_pairs (artist_id, region_id) VALUES (?, ?)", pairs)
+
+    boundary = archive.archived_before(conn) or ""
+    days = {date.fromisoformat(d) for d in iso_dates}
+    for grain in GRAINS:
+        for key in sorted({period_key(grain, d) for d in days}):
+            lo, hi = period_bounds(grain, key)
+            if lo < boundary:
+                continue
+            conn.execute("""
+                DELETE FROM stream_rollups
+                WHERE grain = ? AND period = ?
+                  AND (artist_id, region_id) IN (SELECT artist_id, region_id FROM temp.rollup_pairs)
+            """, (grain, key))
+            conn.execute("""
+                INSERT INTO stream_rollups (grain, period, region_id, artist_id, metric_id, total, days)
+                SELECT ?, ?, s.region_id, s.artist_id, s.metric_id, SUM(s.count), COUNT(*)
+                FROM temp.rollup_pairs p
+                JOIN streams s ON s.artist_id = p.artist_id AND s.region_id = p.region_id
+                WHERE s.iso_date BETWEEN ? AND ?
+                GROUP BY s.region_id, s.artist_id, s.metric_id
+            """, (grain, key, lo, hi))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the week/month/year stream rollup tables.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    args = parser.parse_args(argv)
+
+    conn = db.connect(args.db)
+    try:
+        ensure_schema(conn)
+        print("Rebuilding rollups")
+        rebuild_rollups(conn)
+    finally:
+        conn.close()
+    print(f"Rollups rebuilt: {args.db}")
+
+if __name__ == "__main__":
+    main()
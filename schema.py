@@ -0,0 +1,299 @@
+import argparse
+from datetime import datetime
+
+import db
+
+DB_PATH = "/Users/georgeharrison/Desktop/ARTIST STAT PROJECT/data-money/datamoney.db"
+BATCH_SIZE = 50000
+
+# New databases use integer keys and a streams table clustered on its natural key. Databases
+# created before that keep UUID text ids (and streams.stream_id/date) until migrate_keys.py
+# rewrites them; everything here works with both layouts.
+TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS artists (
+    artist_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    uuid TEXT
+);
+CREATE TABLE IF NOT EXISTS regions (
+    region_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    uuid TEXT
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    metric_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    uuid TEXT
+);
+CREATE TABLE IF NOT EXISTS streams (
+    artist_id INTEGER NOT NULL,
+    region_id INTEGER NOT NULL,
+    metric_id INTEGER NOT NULL,
+    iso_date TEXT NOT NULL,
+    count INTEGER,
+    PRIMARY KEY (artist_id, region_id, metric_id, iso_date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stream_rollups (
+    grain TEXT NOT NULL,
+    period TEXT NOT NULL,
+    region_id INTEGER NOT NULL,
+    artist_id INTEGER NOT NULL,
+    metric_id INTEGER NOT NULL,
+    total INTEGER,
+    days INTEGER,
+    PRIMARY KEY (grain, period, region_id, artist_id, metric_id)
+);
+CREATE TABLE IF NOT EXISTS ingest_manifest (
+    path TEXT PRIMARY KEY,
+    sha256 TEXT,
+    size INTEGER,
+    mtime REAL,
+    row_count INTEGER,
+    status TEXT NOT NULL,
+    batch_id TEXT,
+    started_at TEXT,
+    finished_at TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_ingest_manifest_sha256 ON ingest_manifest(sha256);
+CREATE TABLE IF NOT EXISTS stream_coverage (
+    artist_id INTEGER NOT NULL,
+    region_id INTEGER NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    PRIMARY KEY (artist_id, region_id, start_date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stream_gaps (
+    artist_id INTEGER NOT NULL,
+    region_id INTEGER NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    first_seen TEXT NOT NULL,
+    filled_at TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_stream_gaps_open ON stream_gaps(artist_id, region_id, start_date) WHERE filled_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_stream_gaps_first_seen ON stream_gaps(first_seen);
+CREATE INDEX IF NOT EXISTS idx_stream_gaps_filled_at ON stream_gaps(filled_at);
+CREATE TABLE IF NOT EXISTS alerts (
+    iso_date TEXT NOT NULL,
+    region_id INTEGER NOT NULL,
+    metric_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    artist_id INTEGER NOT NULL,
+    value REAL,
+    baseline REAL,
+    score REAL,
+    PRIMARY KEY (iso_date, region_id, metric_id, kind, artist_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# index name -> CREATE statement; the natural key must be created UNIQUE (with integer
+# keys it is the primary key, so ux_streams_natural_key is only built for UUID databases)
+INDEXES = {
+    "idx_streams_iso_date":
+        "CREATE INDEX IF NOT EXISTS idx_streams_iso_date ON streams(iso_date)",
+    "idx_streams_region_metric_date":
+        "CREATE INDEX IF NOT EXISTS idx_streams_region_metric_date ON streams(region_id, metric_id, iso_date, artist_id, count)",
+    "idx_streams_artist_metric_date":
+        "CREATE INDEX IF NOT EXISTS idx_streams_artist_metric_date ON streams(artist_id, region_id, metric_id, iso_date, count)",
+    "ux_streams_natural_key":
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_streams_natural_key ON streams(artist_id, region_id, metric_id, iso_date)",
+    "idx_artists_name":
+        "CREATE INDEX IF NOT EXISTS idx_artists_name ON artists(name)",
+    "idx_regions_name":
+        "CREATE INDEX IF NOT EXISTS idx_regions_name ON regions(name)",
+    "idx_metrics_name":
+        "CREATE INDEX IF NOT EXISTS idx_metrics_name ON metrics(name)",
+}
+
+def to_iso(date_str):
+    """Convert a streams.date value ('%m/%d/%Y') to a sortable 'YYYY-MM-DD' string."""
+    return datetime.strptime(str(date_str).strip(), "%m/%d/%Y").strftime("%Y-%m-%d")
+
+def has_column(conn, table, column):
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+def uuid_keys(conn):
+    """True for a database still on UUID text ids, i.e. not yet run through migrate_keys.py."""
+    return has_column(conn, "streams", "stream_id")
+
+# Superseded by the metric-aware indexes above; dropped by ensure_indexes
+OBSOLETE_INDEXES = ("idx_streams_region_date", "idx_streams_artist_region_date")
+
+def required_indexes(conn):
+    if uuid_keys(conn):
+        return list(INDEXES)
+    # The WITHOUT ROWID primary key already is (artist_id, region_id, metric_id, iso_date) + count
+    return [name for name in INDEXES if name not in ("ux_streams_natural_key", "idx_streams_artist_metric_date")]
+
+def existing_indexes(conn):
+    """Return {index_name: (table, is_unique)} for user-created indexes."""
+    indexes = {}
+    for (table,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+        for _, name, unique, origin, _ in conn.execute(f"PRAGMA index_list({table})").fetchall():
+            if origin == "c":
+                indexes[name] = (table, bool(unique))
+    return indexes
+
+def create_tables(conn):
+    conn.executescript(TABLES_SQL)
+
+def has_table(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+def get_meta(conn, key):
+    if not has_table(conn, "meta"):
+        return None
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def set_meta(conn, key, value):
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+def backfill_iso_dates(conn, batch_size=BATCH_SIZE):
+    """Fill streams.iso_date from streams.date in rowid-ordered batches, committing after each batch."""
+    last_rowid = 0
+    updated = 0
+    failed = 0
+    while True:
+        rows = conn.execute("""
+            SELECT rowid, date FROM streams
+            WHERE rowid > ?
+            ORDER BY rowid
+            LIMIT ?
+        """, (last_rowid, batch_size)).fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1][0]
+
+        params = []
+        for rowid, date_str in rows:
+            try:
+                params.append((to_iso(date_str), rowid))
+            except ValueError:
+                failed += 1
+        conn.executemany("UPDATE streams SET iso_date = ? WHERE rowid = ? AND iso_date IS NULL", params)
+        conn.commit()
+        updated += len(params)
+        print(f"  backfilled {updated} rows")
+
+    if failed:
+        print(f"  {failed} rows have an unparseable date and were left without iso_date")
+    return updated
+
+def ensure_iso_date(conn, batch_size=BATCH_SIZE):
+    """
+    Add and backfill streams.iso_date if it is missing, and make sure the trigger and
+    index that keep it populated and range-scannable exist. Cheap to call on a migrated DB;
+    a no-op with integer keys, where iso_date is part of the primary key.
+    """
+    if not uuid_keys(conn):
+        return
+    if not has_column(conn, "streams", "iso_date"):
+        print("Adding streams.iso_date column")
+        conn.execute("ALTER TABLE streams ADD COLUMN iso_date TEXT")
+        conn.commit()
+        backfill_iso_dates(conn, batch_size)
+
+    # Writers that only set the legacy date column still get iso_date filled in
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS streams_fill_iso_date
+        AFTER INSERT ON streams
+        WHEN NEW.iso_date IS NULL AND length(NEW.date) = 10
+        BEGIN
+            UPDATE streams
+            SET iso_date = substr(NEW.date, 7, 4) || '-' || substr(NEW.date, 1, 2) || '-' || substr(NEW.date, 4, 2)
+            WHERE rowid = NEW.rowid;
+        END
+    """)
+    conn.execute(INDEXES["idx_streams_iso_date"])
+    conn.commit()
+
+def dedupe_streams(conn):
+    """Delete duplicate rows per (artist, region, metric, date), keeping the most recently inserted one."""
+    cur = conn.execute("""
+        DELETE FROM streams
+        WHERE rowid NOT IN (
+            SELECT MAX(rowid) FROM streams
+            GROUP BY artist_id, region_id, metric_id, iso_date
+        )
+    """)
+    conn.commit()
+    return cur.rowcount
+
+def ensure_indexes(conn):
+    """
+    Create the snapshot covering index, the name lookup indexes and the natural-key
+    uniqueness constraint. Existing duplicates are removed before the unique index is built,
+    otherwise INSERT OR IGNORE never has anything to ignore (stream_id is a fresh UUID).
+    """
+    indexes = existing_indexes(conn)
+    missing = [name for name in required_indexes(conn) if name not in indexes]
+    obsolete = [name for name in OBSOLETE_INDEXES if name in indexes]
+    for name in obsolete:
+        print(f"  dropping index {name}")
+        conn.execute(f"DROP INDEX {name}")
+    if not missing:
+        conn.commit()
+        return
+    if "ux_streams_natural_key" in missing:
+        removed = dedupe_streams(conn)
+        if removed:
+            print(f"  removed {removed} duplicate stream rows")
+    for name in missing:
+        print(f"  creating index {name}")
+        conn.execute(INDEXES[name])
+    conn.execute("ANALYZE")
+    conn.commit()
+
+def verify_schema(conn):
+    """Return a list of problems with the schema; empty when it is up to date."""
+    problems = []
+    if not has_column(conn, "streams", "iso_date"):
+        problems.append("streams.iso_date column is missing")
+    elif conn.execute("SELECT 1 FROM streams WHERE iso_date IS NULL LIMIT 1").fetchone():
+        problems.append("streams.iso_date is not fully backfilled")
+
+    indexes = existing_indexes(conn)
+    for name in required_indexes(conn):
+        if name not in indexes:
+            problems.append(f"index {name} is missing")
+    for name in OBSOLETE_INDEXES:
+        if name in indexes:
+            problems.append(f"index {name} is obsolete")
+    if "ux_streams_natural_key" in indexes and not indexes["ux_streams_natural_key"][1]:
+        problems.append("index ux_streams_natural_key is not UNIQUE")
+    return problems
+
+def ensure_schema(conn, batch_size=BATCH_SIZE):
+    create_tables(conn)
+    ensure_iso_date(conn, batch_size)
+    ensure_indexes(conn)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate a datamoney database to the current schema.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Rows per backfill transaction")
+    parser.add_argument("--check", action="store_true", help="Only verify the schema, do not change it")
+    args = parser.parse_args(argv)
+
+    conn = db.connect(args.db)
+    try:
+        if not args.check:
+            ensure_schema(conn, args.batch_size)
+        problems = verify_schema(conn)
+    finally:
+        conn.close()
+
+    if problems:
+        for problem in problems:
+            print(f"  {problem}")
+        raise SystemExit(1)
+    print(f"Schema up to date: {args.db}")
+
+if __name__ == "__main__":
+    main()
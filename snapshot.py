@@ -0,0 +1,277 @@
+import calendar
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+import archive
+import perf
+from rollups import period_key, rollups_built
+
+REGIONS = ("US", "Global")
+METRICS = ("Streaming On-Demand Audio",)  # the metric ingestion.py loads
+
+# Calendar-aligned modes that can be answered from stream_rollups (Weekly is a rolling 7 days)
+ROLLUP_GRAINS = {"Monthly Streams": "month", "Yearly Streams": "year"}
+
+ROLLING_WINDOWS = (7, 28)  # trailing day windows averaged in the artist drill-down
+
+def period_ranges(mode, cur_date, prev_date):
+    """Return the (start, end) date ranges compared by the given app mode."""
+    if mode == "Daily Streams":
+        cur_range = (cur_date, cur_date)
+        prev_range = (prev_date, prev_date)
+    elif mode == "Weekly Streams":
+        cur_range = (cur_date - timedelta(days=6), cur_date)
+        prev_range = (prev_date - timedelta(days=6), prev_date)
+    elif mode == "Monthly Streams":
+        cur_range = (cur_date.replace(day=1), cur_date.replace(day=calendar.monthrange(cur_date.year, cur_date.month)[1]))
+        prev_range = (prev_date.replace(day=1), prev_date.replace(day=calendar.monthrange(prev_date.year, prev_date.month)[1]))
+    elif mode == "Yearly Streams":
+        cur_range = (cur_date.replace(month=1, day=1), cur_date.replace(month=12, day=31))
+        prev_range = (prev_date.replace(month=1, day=1), prev_date.replace(month=12, day=31))
+    else:
+        raise ValueError(f"Unknown mode: {mode}")
+    return cur_range, prev_range
+
+def _periods(cur_range, prev_range):
+    """The ("cur", lo, hi) and ("prev", lo, hi) ISO date ranges the snapshot queries read."""
+    return [
+        ("cur", cur_range[0].isoformat(), cur_range[1].isoformat()),
+        ("prev", prev_range[0].isoformat(), prev_range[1].isoformat()),
+    ]
+
+def snapshot_sql(n_regions, n_metrics=1, n_periods=2):
+    # One statement for every region x metric x period: each combination drives an index range
+    # scan on streams(region_id, metric_id, iso_date, ...), so the cost grows with the rows
+    # read, not with the number of statements, and overlapping ranges are counted in both.
+    # Totals are grouped by artist_id first so the name join runs once per artist, not per day.
+    region_placeholders = ",".join("?" * n_regions)
+    metric_placeholders = ",".join("?" * n_metrics)
+    values = ", ".join(["(?, ?, ?)"] * n_periods)
+    return f"""
+    WITH periods(period, lo, hi) AS (VALUES {values})
+    SELECT a.name AS artist, t.region, t.metric, t.period, t.total
+    FROM (
+        SELECT s.artist_id, r.name AS region, m.name AS metric, p.period AS period, SUM(s.count) AS total
+        FROM regions r
+        CROSS JOIN metrics m
+        CROSS JOIN periods p
+        JOIN streams s ON s.region_id = r.region_id AND s.metric_id = m.metric_id
+             AND s.iso_date BETWEEN p.lo AND p.hi
+        WHERE r.name IN ({region_placeholders}) AND m.name IN ({metric_placeholders})
+        GROUP BY s.artist_id, r.region_id, m.metric_id, p.period
+    ) t
+    JOIN artists a ON a.artist_id = t.artist_id
+    """
+
+def rollup_sql(n_regions, n_metrics=1, n_periods=2):
+    # stream_rollups holds one row per (grain, period, region, artist, metric), so the rows
+    # are read as they are; there is nothing left to group.
+    region_placeholders = ",".join("?" * n_regions)
+    metric_placeholders = ",".join("?" * n_metrics)
+    values = ", ".join(["(?, ?)"] * n_periods)
+    return f"""
+    WITH periods(period, key) AS (VALUES {values})
+    SELECT a.name AS artist, r.name AS region, m.name AS metric, p.period AS period, ru.total AS total
+    FROM regions r
+    CROSS JOIN metrics m
+    CROSS JOIN periods p
+    CROSS JOIN stream_rollups ru
+    JOIN artists a ON a.artist_id = ru.artist_id
+    WHERE ru.grain = ? AND ru.period = p.key AND ru.region_id = r.region_id AND ru.metric_id = m.metric_id
+      AND r.name IN ({region_placeholders}) AND m.name IN ({metric_placeholders})
+    """
+
+def pct_change(now, then):
+    """Vectorized % change over float arrays; missing or zero previous values give NaN."""
+    then = np.where(then != 0, then, np.nan)
+    return np.round((now - then) / then * 100, 2)
+
+def comparison_label(region, metric, metrics=METRICS):
+    """Column prefix for one region/metric pair; the metric is only named when several are compared."""
+    return f"{region} {metric}" if len(metrics) > 1 else region
+
+def comparison_columns(label):
+    """(current, previous, % change) column names for a comparison_label()."""
+    return f"{label} Streams", f"{label} Streams Prev", f"% Change {label}"
+
+def pivot_snapshot(long_df, regions=REGIONS, metrics=METRICS):
+    """
+    Reshape (artist, region, metric, period, total) rows into the grid's one-row-per-artist
+    layout. The % change of every region/metric pair is computed in one step over the
+    (artists x pairs) matrices, so more regions only add columns.
+    """
+    wide = long_df.groupby(["artist", "region", "metric", "period"])["total"].sum().unstack(["region", "metric", "period"])
+    pairs = [(region, metric) for region in regions for metric in metrics]
+    now = wide.reindex(columns=[(r, m, "cur") for r, m in pairs]).to_numpy(dtype=float)
+    then = wide.reindex(columns=[(r, m, "prev") for r, m in pairs]).to_numpy(dtype=float)
+    change = pct_change(now, then)
+
+    columns = {"Artist": wide.index.to_numpy()}
+    for i, (region, metric) in enumerate(pairs):
+        now_col, prev_col, pct_col = comparison_columns(comparison_label(region, metric, metrics))
+        columns[now_col] = now[:, i]
+        columns[prev_col] = then[:, i]
+        columns[pct_col] = change[:, i]
+    return pd.DataFrame(columns)
+
+def fetch_snapshot(conn, mode, cur_date, prev_date, regions=REGIONS, metrics=METRICS, use_rollups=True, parquet_root=None):
+    """
+    Per-artist current/previous totals and % change for every region and metric, in a
+    single query. Monthly and yearly comparisons read one precomputed row per artist per
+    period when the rollups have been built. With parquet_root, range totals are read from
+    the Parquet export (see parquet_store.py) instead of SQLite. Days archive.py has moved
+    out of streams are read from its year files.
+    """
+    if parquet_root:
+        import parquet_store  # pyarrow is only loaded for this backend and for archived days
+
+        periods = _periods(*period_ranges(mode, cur_date, prev_date))
+        with perf.stage("snapshot.parquet") as record:
+            long_df = parquet_store.fetch_totals(parquet_root, periods, regions, metrics)
+            record["rows"] = len(long_df)
+        with perf.stage("snapshot.pivot"):
+            return pivot_snapshot(long_df, regions, metrics)
+
+    rows = []
+    for sql, params in snapshot_queries(conn, mode, cur_date, prev_date, regions, metrics, use_rollups):
+        with perf.stage("snapshot.query", plan=perf.plan(conn, sql, params)) as record:
+            rows += conn.execute(sql, params).fetchall()
+            record["rows"] = len(rows)
+    rows += archived_rows(conn, mode, cur_date, prev_date, regions, metrics)
+    with perf.stage("snapshot.pivot"):
+        return pivot_snapshot(long_frame(rows), regions, metrics)
+
+def snapshot_queries(conn, mode, cur_date, prev_date, regions=REGIONS, metrics=METRICS, use_rollups=True, split=0):
+    """
+    (sql, params) statements whose (artist, region, metric, period, total) rows together
+    make up a snapshot. By default that is one statement; with split=n, up to n statements
+    (one per period and share of the regions) so they can run concurrently on separate
+    connections. Either way the number of statements does not grow with the regions.
+    Days moved to the archive are left out; archived_rows() reads them.
+    """
+    regions, metrics = list(regions), list(metrics)
+    boundary = archive.archived_before(conn)
+    periods = _periods(*period_ranges(mode, cur_date, prev_date))
+    hot_periods, _ = archive.split_periods(periods, boundary)
+    if use_rollups and mode in ROLLUP_GRAINS and rollups_built(conn):
+        grain = ROLLUP_GRAINS[mode]
+        # Rollups are only kept for days still in streams. The archive boundary is a
+        # January 1st, so a month or year is either wholly hot or wholly archived.
+        keys = {"cur": period_key(grain, cur_date), "prev": period_key(grain, prev_date)}
+        periods = [(period, keys[period]) for period, _, _ in hot_periods]
+        def query(periods, regions):
+            sql = rollup_sql(len(regions), len(metrics), len(periods))
+            return sql, [*sum(periods, ()), grain, *regions, *metrics]
+    else:
+        periods = hot_periods
+        def query(periods, regions):
+            sql = snapshot_sql(len(regions), len(metrics), len(periods))
+            return sql, [*sum(periods, ()), *regions, *metrics]
+
+    if not periods:
+        return []
+    if not split:
+        return [query(periods, regions)]
+    shares = max(1, min(split // len(periods), len(regions)))
+    return [query([period], regions[i::shares]) for i in range(shares) for period in periods]
+
+def archived_rows(conn, mode, cur_date, prev_date, regions=REGIONS, metrics=METRICS):
+    """
+    The (artist, region, metric, period, total) rows of the compared days that archive.py
+    has moved out of streams, read from the year files; [] when the periods are all in SQLite.
+    """
+    boundary = archive.archived_before(conn)
+    if not boundary:
+        return []
+    _, cold_periods = archive.split_periods(_periods(*period_ranges(mode, cur_date, prev_date)), boundary)
+    if not cold_periods:
+        return []
+    with perf.stage("snapshot.archive", periods=len(cold_periods)) as record:
+        rows = archive.fetch_totals(conn, cold_periods, regions, metrics)
+        record["rows"] = len(rows)
+    return rows
+
+def long_frame(rows):
+    return pd.DataFrame.from_records(rows, columns=["artist", "region", "metric", "period", "total"])
+
+def select_rows(df, sort_by, descending=True, limit=None, offset=0, min_volume=0, volume_col=None, search=None):
+    """
+    Server-side filter, sort and paging of a snapshot, so only the rows on screen are sent
+    to the browser. Rows need volume_col >= min_volume (the previous period, so tiny bases
+    don't dominate % change) and an artist name containing search. Missing sort values sort
+    last. Returns (page, number of matching rows).
+    """
+    keep = np.ones(len(df), dtype=bool)
+    if min_volume and volume_col:
+        keep &= df[volume_col].to_numpy(dtype=float, na_value=np.nan) >= min_volume
+    if search:
+        keep &= df["Artist"].str.contains(search, case=False, regex=False, na=False).to_numpy()
+    idx = np.flatnonzero(keep)
+    total = len(idx)
+
+    keys = df[sort_by].to_numpy(dtype=float, na_value=np.nan)[idx]
+    if descending:
+        keys = -keys
+    keys = np.where(np.isnan(keys), np.inf, keys)
+
+    end = total if limit is None else min(offset + limit, total)
+    if end < total:
+        # Only the first `end` keys need ordering
+        head = np.argpartition(keys, end - 1)[:end]
+        order = head[np.argsort(keys[head], kind="stable")]
+    else:
+        order = np.argsort(keys, kind="stable")
+    return df.iloc[idx[order[offset:end]]].reset_index(drop=True), total
+
+def series_sql(n_regions, n_metrics=1):
+    # Artist, regions and metrics are resolved through their name indexes, then each
+    # region/metric pair is one range scan of streams(artist_id, region_id, metric_id, iso_date).
+    region_placeholders = ",".join("?" * n_regions)
+    metric_placeholders = ",".join("?" * n_metrics)
+    return f"""
+    SELECT r.name AS region, s.iso_date, SUM(s.count) AS total
+    FROM artists a
+    CROSS JOIN regions r
+    CROSS JOIN metrics m
+    JOIN streams s ON s.artist_id = a.artist_id AND s.region_id = r.region_id AND s.metric_id = m.metric_id
+         AND s.iso_date BETWEEN ? AND ?
+    WHERE a.name = ? AND r.name IN ({region_placeholders}) AND m.name IN ({metric_placeholders})
+    GROUP BY r.region_id, s.iso_date
+    """
+
+def artist_series(conn, artist, regions=REGIONS, metrics=METRICS, start=None, end=None, windows=ROLLING_WINDOWS):
+    """
+    One artist's daily totals per region (summed over metrics) with trailing rolling means,
+    indexed by date. Days without data are gaps (NaN) and are skipped by the rolling means.
+    Columns are "{region} Streams" and "{region} {n}-Day Avg" for each window.
+    """
+    params = [start.isoformat() if start else "0000-00-00", end.isoformat() if end else "9999-99-99",
+              artist, *regions, *metrics]
+    boundary = archive.archived_before(conn)
+    if boundary and params[0] < boundary:
+        params[0] = boundary
+    sql = series_sql(len(regions), len(metrics))
+    with perf.stage("series.query", plan=perf.plan(conn, sql, params)) as record:
+        rows = conn.execute(sql, params).fetchall()
+        record["rows"] = len(rows)
+    if boundary and (not start or start.isoformat() < boundary):
+        with perf.stage("series.archive") as record:
+            archived = archive.artist_days(conn, artist, regions, metrics,
+                                           start.isoformat() if start else None, end.isoformat() if end else None)
+            record["rows"] = len(archived)
+        rows = archived + rows
+    long_df = pd.DataFrame.from_records(rows, columns=["region", "iso_date", "total"])
+    daily = long_df.pivot(index="iso_date", columns="region", values="total").reindex(columns=list(regions))
+    daily.index = pd.to_datetime(daily.index, format="%Y-%m-%d")
+    if not daily.empty:
+        daily = daily.reindex(pd.date_range(daily.index.min(), daily.index.max(), freq="D"))
+    daily = daily.astype(float)
+
+    out = pd.DataFrame(index=daily.index.rename("Date"))
+    for region in regions:
+        out[f"{region} Streams"] = daily[region]
+        for window in windows:
+            out[f"{region} {window}-Day Avg"] = daily[region].rolling(window, min_periods=1).mean().round(1)
+    return out
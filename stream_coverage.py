@@ -0,0 +1,106 @@
+import argparse
+import time
+from datetime import date, datetime
+
+import archive
+import db
+from schema import DB_PATH, create_tables, ensure_schema, get_meta, set_meta
+
+def coverage_built(conn):
+    """Coverage is only complete (and safe to read) after a full rebuild."""
+    return get_meta(conn, "coverage_built_at") is not None
+
+def to_intervals(ordinals):
+    """Sorted day ordinals -> [(first, last)] runs of consecutive days."""
+    intervals = []
+    for day in ordinals:
+        if intervals and day == intervals[-1][1] + 1:
+            intervals[-1][1] = day
+        else:
+            intervals.append([day, day])
+    return [tuple(i) for i in intervals]
+
+def merge_intervals(intervals):
+    """Union of (first, last) ordinal intervals; overlapping and adjacent ones are joined."""
+    merged = []
+    for lo, hi in sorted(intervals):
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], hi)
+        else:
+            merged.append([lo, hi])
+    return [tuple(i) for i in merged]
+
+def rebuild_coverage(conn):
+    """
+    Recompute every (artist, region) covered date interval from streams and the archived
+    years. Returns the interval count.
+    """
+    create_tables(conn)
+    conn.execute("DELETE FROM stream_coverage")
+    # Consecutive days share the same (day number - row number), so each island is one interval
+    cur = conn.execute("""
+        INSERT INTO stream_coverage (artist_id, region_id, start_date, end_date)
+        SELECT artist_id, region_id, MIN(iso_date), MAX(iso_date)
+        FROM (
+            SELECT artist_id, region_id, iso_date,
+                   julianday(iso_date) - ROW_NUMBER() OVER (PARTITION BY artist_id, region_id ORDER BY iso_date) AS island
+            FROM (SELECT DISTINCT artist_id, region_id, iso_date FROM streams WHERE iso_date >= ?)
+        )
+        GROUP BY artist_id, region_id, island
+    """, (archive.archived_before(conn) or "",))
+    # A run ending on the last archived day and one starting on the boundary stay two
+    # adjacent intervals; gap checks treat them as continuous
+    archived = conn.executemany("""
+        INSERT INTO stream_coverage (artist_id, region_id, start_date, end_date) VALUES (?, ?, ?, ?)
+    """, [(artist_id, region_id, date.fromordinal(lo).isoformat(), date.fromordinal(hi).isoformat())
+          for artist_id, region_id, lo, hi in archive.coverage_runs(conn)])
+    set_meta(conn, "coverage_built_at", datetime.now().isoformat(timespec="seconds"))
+    conn.commit()
+    return cur.rowcount + max(archived.rowcount, 0)
+
+def refresh_coverage(conn, pair_dates):
+    """
+    Merge newly written days into the covered intervals. pair_dates maps
+    (artist_id, region_id) to the ISO dates written for it. Only intervals touching the
+    new days are read and rewritten. Does nothing until coverage has been fully built.
+    Does not commit; callers commit together with the stream rows.
+    """
+    if not pair_dates or not coverage_built(conn):
+        return
+    for (artist_id, region_id), iso_dates in pair_dates.items():
+        new = to_intervals(sorted({date.fromisoformat(d).toordinal() for d in iso_dates}))
+        if not new:
+            continue
+        lo, hi = new[0][0], new[-1][1]
+        existing = conn.execute("""
+            SELECT start_date, end_date FROM stream_coverage
+            WHERE artist_id = ? AND region_id = ? AND start_date <= ? AND end_date >= ?
+        """, (artist_id, region_id, date.fromordinal(hi + 1).isoformat(), date.fromordinal(lo - 1).isoformat())).fetchall()
+
+        merged = merge_intervals(new + [
+            (date.fromisoformat(s).toordinal(), date.fromisoformat(e).toordinal()) for s, e in existing
+        ])
+        conn.executemany("""
+            DELETE FROM stream_coverage WHERE artist_id = ? AND region_id = ? AND start_date = ?
+        """, [(artist_id, region_id, s) for s, _ in existing])
+        conn.executemany("""
+            INSERT INTO stream_coverage (artist_id, region_id, start_date, end_date) VALUES (?, ?, ?, ?)
+        """, [(artist_id, region_id, date.fromordinal(s).isoformat(), date.fromordinal(e).isoformat())
+              for s, e in merged])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the per-artist/region date coverage intervals.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    args = parser.parse_args(argv)
+
+    conn = db.connect(args.db)
+    try:
+        ensure_schema(conn)
+        t0 = time.perf_counter()
+        n = rebuild_coverage(conn)
+    finally:
+        conn.close()
+    print(f"Coverage rebuilt: {n} intervals in {time.perf_counter() - t0:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import sqlite3
+import argparse
+import os
+import random
+import time
+from datetime import date, timedelta
+
+from openpyxl import Workbook
+
+from schema import create_tables
+
+METRICS = ("Streaming On-Demand Audio", "Streaming On-Demand Video", "Programmed Audio")
+MAX_GAP_DAYS = 10  # longest run of missing days in one artist/region series
+
+def artist_names(n_artists):
+    return [f"Artist {i:05d}" for i in range(n_artists)]
+
+def present_days(rng, n_days, gap_rate):
+    """Day offsets with data; each day starts a run of 1..MAX_GAP_DAYS missing days with probability gap_rate."""
+    days = []
+    day = 0
+    while day < n_days:
+        if gap_rate and rng.random() < gap_rate:
+            day += rng.randint(1, MAX_GAP_DAYS)
+            continue
+        days.append(day)
+        day += 1
+    return days
+
+def build_synthetic_db(path, n_artists, regions, start, n_days, gap_rate=0.0, seed=0):
+    """
+    Create a datamoney-schema DB with one row per artist x region x day, minus runs of
+    missing days when gap_rate > 0. Returns the number of stream rows.
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    create_tables(conn)
+
+    metric_id = 1
+    conn.execute("INSERT INTO metrics (metric_id, name) VALUES (?, ?)", (metric_id, METRICS[0]))
+    region_ids = list(range(1, len(regions) + 1))
+    conn.executemany("INSERT INTO regions (region_id, name) VALUES (?, ?)", zip(region_ids, regions))
+    artist_ids = list(range(1, n_artists + 1))
+    conn.executemany("INSERT INTO artists (artist_id, name) VALUES (?, ?)", zip(artist_ids, artist_names(n_artists)))
+
+    iso_dates = [(start + timedelta(days=i)).isoformat() for i in range(n_days)]
+
+    # Generated in primary-key order, so the WITHOUT ROWID table is appended to, never split
+    def rows():
+        for artist_id in artist_ids:
+            base = rng.lognormvariate(8, 2)
+            for region_id in region_ids:
+                for i in present_days(rng, n_days, gap_rate):
+                    count = int(base * rng.uniform(0.7, 1.3))
+                    yield (artist_id, region_id, metric_id, iso_dates[i], count)
+
+    cur = conn.executemany("""
+        INSERT INTO streams (artist_id, region_id, metric_id, iso_date, count)
+        VALUES (?, ?, ?, ?, ?)
+    """, rows())
+    conn.commit()
+    conn.close()
+    return cur.rowcount
+
+def write_workbook(path, region, artists, start, n_days, gap_rate=0.0, seed=0):
+    """
+    Write one export in the layout ingestion.py parses: a "Report Summary" sheet naming
+    the country, then one sheet per artist with the Artist row, the date header row and
+    one row per metric. Missing days are left out of that artist's date header.
+    """
+    rng = random.Random(seed)
+    wb = Workbook(write_only=True)
+    summary = wb.create_sheet("Report Summary")
+    summary.append(["Report", "Artist Streams Export"])
+    summary.append(["Country", region])
+    summary.append(["Date Range", f"{start:%m/%d/%Y} - {start + timedelta(days=n_days - 1):%m/%d/%Y}"])
+
+    for name in artists:
+        days = present_days(rng, n_days, gap_rate)
+        base = rng.lognormvariate(8, 2)
+        ws = wb.create_sheet(name[:31])
+        ws.append([None, "Artist Streams Report"])
+        ws.append([None, "Artist", name])
+        ws.append([])
+        ws.append([None, "Country", region])
+        ws.append([])
+        ws.append([])
+        ws.append([None, "Metric", *[(start + timedelta(days=i)).strftime("%m/%d/%Y") for i in days]])
+        for metric in METRICS:
+            ws.append([None, metric, *[int(base * rng.uniform(0.7, 1.3)) for _ in days]])
+    wb.save(path)
+
+def write_exports(out_dir, n_artists, regions, start, n_days, gap_rate=0.0, seed=0):
+    """One workbook per region under out_dir, as downloaded from the reporting tool. Returns the paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    artists = artist_names(n_artists)
+    paths = []
+    for i, region in enumerate(regions):
+        path = os.path.join(out_dir, f"{region}_{start:%Y%m%d}_{n_days}d.xlsx")
+        write_workbook(path, region, artists, start, n_days, gap_rate, seed + i)
+        paths.append(path)
+    return paths
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic datamoney DB and/or xlsx exports.")
+    parser.add_argument("--db", help="Write a synthetic SQLite DB to this path")
+    parser.add_argument("--xlsx-dir", help="Write one xlsx export per region into this directory")
+    parser.add_argument("--artists", type=int, default=2000)
+    parser.add_argument("--regions", nargs="+", default=["US", "Global"])
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--start", default="2023-01-01", help="First synthetic date (YYYY-MM-DD)")
+    parser.add_argument("--gap-rate", type=float, default=0.0, help="Chance per day of a run of missing days")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if not args.db and not args.xlsx_dir:
+        parser.error("nothing to do: pass --db and/or --xlsx-dir")
+
+    start = date.fromisoformat(args.start)
+    if args.db:
+        if os.path.exists(args.db):
+            os.remove(args.db)
+        t0 = time.perf_counter()
+        rows = build_synthetic_db(args.db, args.artists, args.regions, start, args.days, args.gap_rate, args.seed)
+        print(f"Wrote {rows:,} stream rows to {args.db} in {time.perf_counter() - t0:.1f}s")
+    if args.xlsx_dir:
+        t0 = time.perf_counter()
+        paths = write_exports(args.xlsx_dir, args.artists, args.regions, start, args.days, args.gap_rate, args.seed)
+        print(f"Wrote {len(paths)} workbooks to {args.xlsx_dir} in {time.perf_counter() - t0:.1f}s")
+
+if __name__ == "__main__":
+    main()
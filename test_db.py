@@ -0,0 +1,21 @@
+import bench_concurrency
+import db
+
+def test_readers_alongside_writer_hit_no_lock_errors():
+    results = bench_concurrency.check_concurrency(seconds=1, readers=4, artists=200, days=60)
+    shared = results["db.connect"]
+    assert shared["reads"] > 0 and shared["writes"] > 0
+    assert shared["read_errors"] == 0
+    assert shared["write_errors"] == 0
+
+def test_readonly_path_with_uri_characters(tmp_path):
+    path = tmp_path / "data #1?v=2 100%.db"
+    conn = db.connect(str(path))
+    conn.execute("CREATE TABLE t (x)")
+    conn.execute("INSERT INTO t VALUES (1)")
+    conn.commit()
+    conn.close()
+
+    conn = db.connect(str(path), readonly=True)
+    assert conn.execute("SELECT x FROM t").fetchall() == [(1,)]
+    conn.close()
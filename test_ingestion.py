@@ -0,0 +1,23 @@
+import db
+import ingestion
+
+def test_failed_file_leaves_no_ids_behind(tmp_path, monkeypatch):
+    files = {
+        str(tmp_path / "bad.xlsx"): ("US", [("Alpha", "Streams", "01/02/2024", 5), ("Alpha", "Streams", "not a date", 6)]),
+        str(tmp_path / "good.xlsx"): ("UK", [("Gamma", "Streams", "01/02/2024", 7)]),
+    }
+    for path in files:
+        open(path, "wb").close()
+    monkeypatch.setattr(ingestion, "timed_extract", lambda path, metrics=None: (*files[path], 0.0))
+    db_path = str(tmp_path / "test.db")
+
+    rows, failed = ingestion.ingest_files(list(files), db_path=db_path)
+
+    assert rows == 1 and failed == [str(tmp_path / "bad.xlsx")]
+    conn = db.connect(db_path)
+    assert conn.execute("SELECT name FROM artists").fetchall() == [("Gamma",)]
+    assert conn.execute("""
+        SELECT a.name, r.name, m.name, s.count FROM streams s
+        JOIN artists a USING (artist_id) JOIN regions r USING (region_id) JOIN metrics m USING (metric_id)
+    """).fetchall() == [("Gamma", "UK", "Streams", 7)]
+    conn.close()